@@ -0,0 +1,71 @@
+"""Micro benchmarks for the game engine."""
+import argparse
+import logging
+import random
+import time
+
+from game import Game
+
+logging.disable(logging.INFO)
+
+
+def play(game, steps):
+    for _ in range(steps):
+        game.step(random.choice("wasdA"))
+
+
+def bench_snapshot(args):
+    """Snapshots and restores per second of a game in progress."""
+    random.seed(args.seed)
+    game = Game(level=args.level)
+    game.start("benchmark")
+    play(game, 50)
+
+    for rng in (True, False):
+        start = time.perf_counter()
+        for _ in range(args.n):
+            snapshot = game.snapshot(rng=rng)
+        elapsed = time.perf_counter() - start
+        print(f"snapshot(rng={rng}): {args.n / elapsed:,.0f}/s")
+
+        start = time.perf_counter()
+        for _ in range(args.n):
+            game.restore(snapshot)
+        elapsed = time.perf_counter() - start
+        print(f"restore(rng={rng}): {args.n / elapsed:,.0f}/s")
+
+    # the usual search pattern: fork, play a few steps, go back
+    root = game.snapshot()
+    start = time.perf_counter()
+    for _ in range(args.n // 100):
+        play(game, 5)
+        game.restore(root)
+    elapsed = time.perf_counter() - start
+    print(f"fork + 5 steps + restore: {args.n // 100 / elapsed:,.0f}/s")
+
+
+def bench_vecgame(args):
+    """Steps per second of a batch of games played with random keys."""
+    from vecgame import VecGame
+
+    games = VecGame(args.batch, level=args.level)
+    games.reset(seed=args.seed)
+    start = time.perf_counter()
+    for _ in range(args.n // args.batch):
+        games.step(random.choices("wasdA", k=args.batch))
+    elapsed = time.perf_counter() - start
+    print(f"VecGame({args.batch}): {args.n // args.batch * args.batch / elapsed:,.0f} steps/s")
+
+
+BENCHMARKS = {"snapshot": bench_snapshot, "vecgame": bench_vecgame}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("benchmark", choices=BENCHMARKS)
+    parser.add_argument("--n", help="Number of iterations", type=int, default=100000)
+    parser.add_argument("--level", help="Game level", type=int, default=5)
+    parser.add_argument("--seed", help="Seed number", type=int, default=1)
+    parser.add_argument("--batch", help="Games in a VecGame", type=int, default=64)
+    args = parser.parse_args()
+
+    BENCHMARKS[args.benchmark](args)
@@ -0,0 +1,153 @@
+"""Per client outgoing queues, so that slow clients never hold up the game."""
+import asyncio
+import logging
+from collections import deque
+
+from websockets.exceptions import ConnectionClosed
+
+from protocol import report
+
+logger = logging.getLogger("Channel")
+logger.setLevel(logging.INFO)
+
+MAX_PENDING = 16  # messages waiting to be sent before the client is evicted
+SEND_TIMEOUT = 5  # seconds a single send may take before the client is evicted
+
+
+class Channel:
+    """Messages to one client, sent by a task of its own.
+
+    send() never waits: a message is queued and the task sends the queue in
+    order, as fast as the client takes it. Frames are decimated for a slow
+    client, a frame not sent yet is replaced by the newer one. A delta frame
+    can't replace another, the state would be missing changes, so both are
+    dropped and frames are skipped until the next keyframe. Other messages
+    (the level info) are always sent. A client that can't keep up even so,
+    with more than max_pending messages queued or a send taking longer than
+    timeout (None to wait forever), is disconnected.
+
+    Socket buffers hide a slow client for many frames, so a channel with a
+    window only lets that many frames go unanswered: the client must ack()
+    every frame it gets, and meanwhile newer frames replace the one waiting.
+    With report set, every frame sent is told how many frames were dropped
+    right before it, in "coalesced", and how many messages are still queued
+    behind it, in "queue".
+    """
+
+    def __init__(
+        self,
+        ws,
+        delta=False,
+        max_pending=MAX_PENDING,
+        timeout=SEND_TIMEOUT,
+        window=None,
+        report=False,
+    ):
+        self.ws = ws
+        self.delta = delta
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.window = window
+        self.report = report
+        self._credits = window
+        self.sent = 0
+        self.dropped = 0
+        self._pending = deque()  # (message, is a frame)
+        self._synced = not delta  # a delta client needs a keyframe to begin
+        self._sending_since = None
+        self._ready = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._closing = None  # task closing the connection
+        self._task = asyncio.create_task(self._run())
+
+    def __len__(self):
+        return len(self._pending)
+
+    @property
+    def closed(self):
+        return self._task.done()
+
+    def ack(self):
+        """The client answered a frame, another one can be sent."""
+        if self.window:
+            self._credits = min(self._credits + 1, self.window)
+            self._ready.set()
+
+    def send(self, message):
+        """Queue a message that must be delivered."""
+        self._push(message, frame=False)
+
+    def send_frame(self, frame, keyframe=True):
+        """Queue a frame, keyframe False for a delta frame."""
+        if self._pending and self._pending[-1][1]:
+            self._pending.pop()
+            self.dropped += 1
+            if not keyframe:
+                self._synced = False
+        if not self._synced:
+            if not keyframe:
+                self.dropped += 1
+                return
+            self._synced = True
+        self._push(frame, frame=True)
+
+    def _push(self, message, frame):
+        if self.closed:
+            return
+        loop = asyncio.get_running_loop()
+        if len(self._pending) >= self.max_pending or (
+            self._sending_since is not None
+            and self.timeout is not None
+            and loop.time() - self._sending_since > self.timeout
+        ):
+            logger.warning("Evicting a client that can't keep up")
+            self.close()
+            return
+        self._pending.append((message, frame))
+        self._idle.clear()
+        self._ready.set()
+
+    async def drain(self):
+        """Wait until every message queued is sent, or the client is gone."""
+        idle = asyncio.ensure_future(self._idle.wait())
+        await asyncio.wait([idle, self._task], return_when=asyncio.FIRST_COMPLETED)
+        idle.cancel()
+
+    def close(self):
+        self._task.cancel()
+        if self._closing is None:
+            self._closing = asyncio.create_task(self.ws.close())
+            self._closing.add_done_callback(self._closed)
+
+    @staticmethod
+    def _closed(closing):
+        if not closing.cancelled() and closing.exception() is not None:
+            logger.warning("Could not close a client: %s", closing.exception())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        dropped = 0
+        try:
+            while True:
+                if not self._pending:
+                    self._idle.set()
+                await self._ready.wait()
+                self._ready.clear()
+                while self._pending:
+                    message, frame = self._pending[0]
+                    if frame and self._credits == 0 and len(self._pending) == 1:
+                        break  # wait for an ack, a newer frame may replace this one
+                    self._pending.popleft()
+                    if frame and self.window:
+                        self._credits = max(self._credits - 1, 0)
+                    if frame and self.report:
+                        message = report(
+                            message, self.dropped - dropped, len(self._pending)
+                        )
+                        dropped = self.dropped
+                    self._sending_since = loop.time()
+                    await self.ws.send(message)
+                    self._sending_since = None
+                    self.sent += 1
+        except ConnectionClosed:
+            pass
@@ -26,12 +26,67 @@ logger = logging.getLogger("Characters")
 logger.setLevel(logging.INFO)
 
 
+class Occupancy:
+    """Characters indexed by position, kept up to date as they move.
+
+    Iterating gives the characters in the order they were added, positions
+    is a view of the taken positions for O(1) membership tests.
+    """
+
+    def __init__(self, characters=()):
+        self._characters = list(characters)
+        self._cells = {}
+        for character in self._characters:
+            self._cells.setdefault(character.pos, []).append(character)
+            character._occupancy = self
+
+    def __iter__(self):
+        return iter(self._characters)
+
+    def __len__(self):
+        return len(self._characters)
+
+    def __repr__(self) -> str:
+        return repr(self._characters)
+
+    @property
+    def positions(self):
+        return self._cells.keys()
+
+    def at(self, pos):
+        return self._cells.get(pos, ())
+
+    def taken(self, pos, exclude=None):
+        return any(c is not exclude for c in self._cells.get(pos, ()))
+
+    def add(self, character):
+        self._characters.append(character)
+        self._cells.setdefault(character.pos, []).append(character)
+        character._occupancy = self
+
+    def remove(self, character):
+        self._characters.remove(character)
+        self._leave(character, character.pos)
+        character._occupancy = None
+
+    def _leave(self, character, pos):
+        cell = self._cells[pos]
+        cell.remove(character)
+        if not cell:
+            del self._cells[pos]
+
+    def _move(self, character, old_pos, new_pos):
+        self._leave(character, old_pos)
+        self._cells.setdefault(new_pos, []).append(character)
+
+
 class Character:
     def __init__(self, x=1, y=1):
         self._pos = x, y
         self._spawn_pos = self._pos
         self._direction: Direction = Direction.EAST
         self._history = deque(maxlen=HISTORY_LEN)
+        self._occupancy = None
 
     @property
     def history(self):
@@ -51,6 +106,8 @@ class Character:
             self._direction = Direction.NORTH
         elif value[1] > self._pos[1]:
             self._direction = Direction.SOUTH
+        if self._occupancy is not None and value != self._pos:
+            self._occupancy._move(self, self._pos, value)
         self._pos = value
 
     @property
@@ -69,6 +126,20 @@ class Character:
     def __str__(self) -> str:
         return f"{self.__class__.__name__}({self._pos})"
 
+    # Snapshots are tuples of the mutable state, as search agents take a lot
+    # of them. Each class lists all its fields in one flat tuple, without
+    # super() calls, except Pooka and Fygar: they wrap the Enemy snapshot
+    # with their own fields, so state added to Enemy must go in its tuple.
+    # The move history is only used in log messages and is left out.
+    # restore() doesn't go through the pos setter, the caller rebuilds any
+    # Occupancy.
+
+    def snapshot(self):
+        return self._pos, self._direction
+
+    def restore(self, snapshot):
+        self._pos, self._direction = snapshot
+
     def respawn(self):
         logger.debug("RESPAWN %s @ %s", self, self._spawn_pos)
         self.pos = self._spawn_pos
@@ -102,12 +173,18 @@ class Rock(Character):
     def to_dict(self):
         return {"id": str(self.id), "pos": self.pos}
 
+    def snapshot(self):
+        return self._pos, self._direction, self._falling
+
+    def restore(self, snapshot):
+        self._pos, self._direction, self._falling = snapshot
+
     def __str__(self):
         return f"Rock({self.pos})"
 
     def move(self, mapa, digdug, rocks):
         open_pos = mapa.calc_pos(self.pos, Direction.SOUTH, traverse=False)
-        if open_pos in [r.pos for r in rocks]:  # don't fall on other rocks
+        if open_pos in rocks.positions:  # don't fall on other rocks
             return
 
         if digdug.pos == open_pos and self._falling > 0:
@@ -137,11 +214,17 @@ class DigDug(Character):
     def kill(self):
         self._lives -= 1
 
+    def snapshot(self):
+        return self._pos, self._direction, self._lives
+
+    def restore(self, snapshot):
+        self._pos, self._direction, self._lives = snapshot
+
     def move(self, mapa, direction, enemies, rocks):
         self._history.append(self.pos)
         new_pos = mapa.calc_pos(self.pos, direction)
 
-        if new_pos not in [r.pos for r in rocks]:  # don't bump into rocks
+        if new_pos not in rocks.positions:  # don't bump into rocks
             self.pos = new_pos
             mapa.dig(self.pos)
 
@@ -180,6 +263,34 @@ class Enemy(Character):
             "dir": self.lastdir,
         }
 
+    def snapshot(self):
+        return (
+            self._pos,
+            self._direction,
+            self._wallpass,
+            self.step,
+            self.lastdir,
+            self.lastpos,
+            self.freeze,
+            self._alive,
+            self.exit,
+            self._points,
+        )
+
+    def restore(self, snapshot):
+        (
+            self._pos,
+            self._direction,
+            self._wallpass,
+            self.step,
+            self.lastdir,
+            self.lastpos,
+            self.freeze,
+            self._alive,
+            self.exit,
+            self._points,
+        ) = snapshot
+
     @property
     def traverse(self):
         return self._wallpass
@@ -242,7 +353,7 @@ class Enemy(Character):
 
         if self._smart == Smart.LOW:
             new_pos = mapa.calc_pos(self.pos, self.dir[self.lastdir], self._wallpass)
-            if new_pos in [r.pos for r in rocks]:  # don't bump into rocks
+            if new_pos in rocks.positions:  # don't bump into rocks
                 new_pos = self.pos
             if new_pos == self.pos:
                 self.lastdir = (self.lastdir + random.randint(1, 4)) % len(self.dir)
@@ -254,30 +365,28 @@ class Enemy(Character):
                     mapa.calc_pos(self.pos, d, self._wallpass) for d in Direction
                 ]
                 if pos not in [self.lastpos]
-                and pos not in [r.pos for r in rocks]  # don't bump into rocks
+                and pos not in rocks.positions  # don't bump into rocks
             ]
             if open_pos == []:
                 new_pos = self.lastpos
             else:
-                next_pos = sorted(
-                    open_pos, key=lambda pos: math.dist(digdug.pos, pos), reverse=True
-                )
+                next_pos = self._ranked(mapa, digdug, open_pos, farthest=True)
                 new_pos = next_pos[0]
 
         elif self._smart == Smart.HIGH:
-            enemies_pos = [e.pos for e in enemies if e.id != self.id]
             open_pos = [
                 pos
                 for pos in [
                     mapa.calc_pos(self.pos, d, self._wallpass) for d in Direction
                 ]
-                if pos not in [self.lastpos] + enemies_pos
-                and pos not in [r.pos for r in rocks]  # don't bump into rocks
+                if pos not in [self.lastpos]
+                and not enemies.taken(pos, exclude=self)
+                and pos not in rocks.positions  # don't bump into rocks
             ]
             if open_pos == []:
                 new_pos = self.lastpos
             else:
-                next_pos = sorted(open_pos, key=lambda pos: math.dist(digdug.pos, pos))
+                next_pos = self._ranked(mapa, digdug, open_pos)
                 new_pos = next_pos[0]
 
         self.lastpos = self.pos
@@ -289,6 +398,23 @@ class Enemy(Character):
             self.exit = True
             logger.debug("%s has EXITED through %s", self.id, self.pos[1])
 
+    def _ranked(self, mapa, digdug, positions, farthest=False):
+        """Positions closest to Dig Dug first, or farthest first.
+
+        Positions with a path to Dig Dug through the tunnels are ranked by its
+        length, ahead of the others, ranked by straight line distance. Passing
+        through walls, every position is ranked by straight line distance.
+        """
+        sign = -1 if farthest else 1
+
+        def key(pos):
+            steps = None if self._wallpass else mapa.distance(digdug.pos, pos)
+            if steps is None:
+                return 1, sign * math.dist(digdug.pos, pos)
+            return 0, sign * steps
+
+        return sorted(positions, key=key)
+
     def ready(self):
         self.step += int(self._speed)
         if self.step >= int(Speed.FAST):
@@ -302,6 +428,13 @@ class Pooka(Enemy):
         super().__init__(pos, self.__class__.__name__, Speed.FAST, smart, False)
         self.go_to_corridor = pos
 
+    def snapshot(self):
+        return super().snapshot(), self.go_to_corridor
+
+    def restore(self, snapshot):
+        enemy, self.go_to_corridor = snapshot
+        super().restore(enemy)
+
     def move(self, mapa, digdug, enemies, rocks):
         if self._wallpass:
             self._history.append(self.pos)
@@ -311,7 +444,7 @@ class Pooka(Enemy):
                     mapa.calc_pos(self.pos, d, self._wallpass) for d in Direction
                 ]
                 if pos not in [self.lastpos]
-                and pos not in [r.pos for r in rocks]  # don't bump into rocks
+                and pos not in rocks.positions  # don't bump into rocks
             ]
             if open_pos == []:
                 new_pos = self.lastpos
@@ -339,6 +472,14 @@ class Fygar(Enemy):
         self.fire = []
         super().__init__(pos, self.__class__.__name__, Speed.SLOW, smart, False)
 
+    def snapshot(self):
+        return super().snapshot(), tuple(self.fire)
+
+    def restore(self, snapshot):
+        enemy, fire = snapshot
+        self.fire = list(fire)
+        super().restore(enemy)
+
     def points(self, map_height):
         if self.lastdir in [Direction.EAST, Direction.WEST]:
             return super().points(map_height) * 2
@@ -360,7 +501,7 @@ class Fygar(Enemy):
                 if (
                     pos not in self.fire and
                     pos != self.pos and
-                    pos not in [r.pos for r in rocks]
+                    pos not in rocks.positions
                 ):  # Make sure we don't fire on ourselves and prevent fire through rocks
                     self.fire.append(pos)
                 else:
@@ -1,11 +1,11 @@
-import asyncio
 import logging
 import math
 import random
 
-from characters import DigDug, Direction, Fygar, Pooka, Rock
+from characters import DigDug, Direction, Fygar, Occupancy, Pooka, Rock
 from mapa import VITAL_SPACE, Map
 from consts import Smart, LIVES, TIMEOUT, MAX_LEN_ROPE, MIN_ENEMIES
+from pacing import TickScheduler
 
 logger = logging.getLogger("Game")
 logger.setLevel(logging.DEBUG)
@@ -50,7 +50,14 @@ class Rope:
         return self._pos != []
 
     def to_dict(self):
-        return {"dir": self._dir, "pos": self._pos}
+        return {"dir": self._dir, "pos": list(self._pos)}
+
+    def snapshot(self):
+        return tuple(self._pos), self._dir
+
+    def restore(self, snapshot):
+        pos, self._dir = snapshot
+        self._pos = list(pos)
 
     def shoot(self, pos, direction, _rocks, _enemies):
         if self._dir and direction != self._dir:
@@ -61,7 +68,7 @@ class Rope:
         else:
             new_pos = self._map.calc_pos(pos, direction, traverse=False)
 
-        if new_pos in [r.pos for r in _rocks]:  # we hit a rock
+        if new_pos in _rocks.positions:  # we hit a rock
             return self.__reset_rope()
 
         if new_pos in self._pos:  # we hit a wall
@@ -94,8 +101,11 @@ class Rope:
 
 
 class Game:
-    def __init__(self, level=1, lives=LIVES, timeout=TIMEOUT, size=MAP_SIZE):
+    def __init__(
+        self, level=1, lives=LIVES, timeout=TIMEOUT, size=MAP_SIZE, pacing=None
+    ):
         logger.info(f"Game(level={level}, lives={lives})")
+        self.pacing = pacing or TickScheduler(GAME_SPEED)
         self.initial_level = level
         self._running = False
         self._timeout = timeout
@@ -105,7 +115,8 @@ class Game:
         self._state = {}
         self._initial_lives = lives
         self.map = Map(size=size, empty=True)
-        self._enemies = []
+        self._enemies = Occupancy()
+        self._rocks = Occupancy()
         self._rope = Rope(self.map)
         self.respawn = False
 
@@ -156,7 +167,7 @@ class Game:
         self._step = 0
         self._rope = Rope(self.map)
         self._lastkeypress = ""
-        self._enemies = [
+        self._enemies = Occupancy(
             enemy(
                 pos,
                 smart=random.choices(list(Smart), [1, level // 5, level // 10], k=1)[
@@ -164,9 +175,64 @@ class Game:
                 ],
             )
             for enemy, pos in zip(level_enemies(level), self.map.enemies_spawn)
-        ]
+        )
         logger.debug("Enemies: %s", self._enemies)
-        self._rocks = [Rock(p) for p in self.map.rocks_spawn]
+        self._rocks = Occupancy(Rock(p) for p in self.map.rocks_spawn)
+
+    def snapshot(self, rng=True):
+        """Capture the state of a running game for restore().
+
+        Characters are kept by reference along with a tuple of their state
+        and the map tiles are shared by all snapshots until the next dig.
+        rng=False leaves out the state of the random generator, the most
+        expensive part, for agents that don't need a reproducible future.
+        """
+        return (
+            self.map,
+            self.map.snapshot(),
+            self._running,
+            self._score,
+            self._step,
+            self._total_steps,
+            self.respawn,
+            self._lastkeypress,
+            self._digdug.snapshot(),
+            tuple([(e, e.snapshot()) for e in self._enemies]),
+            tuple([(r, r.snapshot()) for r in self._rocks]),
+            self._rope.snapshot(),
+            random.getstate() if rng else None,
+        )
+
+    def restore(self, snapshot):
+        """Go back to a state captured by snapshot()."""
+        (
+            self.map,
+            tiles,
+            self._running,
+            self._score,
+            self._step,
+            self._total_steps,
+            self.respawn,
+            self._lastkeypress,
+            digdug,
+            enemies,
+            rocks,
+            rope,
+            rng,
+        ) = snapshot
+
+        self.map.restore(tiles)
+        self._digdug.restore(digdug)
+        for e, state in enemies:
+            e.restore(state)
+        self._enemies = Occupancy([e for e, _ in enemies])
+        for r, state in rocks:
+            r.restore(state)
+        self._rocks = Occupancy([r for r, _ in rocks])
+        self._rope = Rope(self.map)
+        self._rope.restore(rope)
+        if rng is not None:
+            random.setstate(rng)
 
     def quit(self):
         logger.debug("Quit")
@@ -174,6 +240,7 @@ class Game:
 
     def keypress(self, key):
         self._lastkeypress = key
+        self.pacing.answered()
 
     def update_digdug(self):
         try:
@@ -259,17 +326,35 @@ class Game:
             if r.pos == self._digdug.pos:
                 logger.debug("[step=%s] %s has killed %s", self._step, r, self._digdug)
                 self.kill_digdug()
-            for e in self._enemies:
-                if r.pos == e.pos:
-                    e.kill(rock=True)
-                    self._score += e.points(self.map.ver_tiles)
+            for e in self._enemies.at(r.pos):
+                e.kill(rock=True)
+                self._score += e.points(self.map.ver_tiles)
 
     async def next_frame(self):
-        await asyncio.sleep(1.0 / GAME_SPEED)
+        await self.pacing.wait()
+        return self.step()
+
+    def step(self, key=None):
+        """Advance the game exactly one frame, without pacing.
+
+        key, when given, is pressed before the frame is computed. Returns the
+        same state as next_frame(), or None if no frame was produced.
+        """
+        if self.advance(key):
+            return self.state()
+
+    def advance(self, key=None):
+        """Advance the game one frame like step(), without building its state.
+
+        Returns False if no frame was produced: the game is not running or a
+        new level has just started.
+        """
+        if key is not None:
+            self.keypress(key)
 
         if not self._running:
             logger.info("Waiting for player 1")
-            return
+            return False
 
         if self.respawn:
             self._digdug.respawn()
@@ -289,7 +374,7 @@ class Game:
             )
 
         if not self.update_digdug():
-            return  # if update_digdug returns false, we have a new level and we stop right here
+            return False  # if update_digdug returns false, we have a new level and we stop right here
 
         self.collision()
 
@@ -311,12 +396,13 @@ class Game:
         self._score += sum(
             [e.points(self.map.ver_tiles) for e in self._enemies if not e.alive]
         )
-        self._enemies = [
-            e for e in self._enemies if e.alive and not e.exit
-        ]  # remove dead and exited enemies
+        for e in [e for e in self._enemies if not e.alive or e.exit]:
+            self._enemies.remove(e)  # remove dead and exited enemies
 
         self.collision()
+        return True
 
+    def state(self):
         self._state = {
             "level": self.map.level,
             "step": self._step,
@@ -332,7 +418,7 @@ class Game:
         for e in self._enemies:
             self._state["enemies"].append(e.to_dict())
             if e.name == "Fygar" and e.fire:
-                self._state["enemies"][-1]["fire"] = e.fire
+                self._state["enemies"][-1]["fire"] = list(e.fire)
             if e.traverse:
                 self._state["enemies"][-1]["traverse"] = e.traverse
 
@@ -344,7 +430,7 @@ class Game:
     def info(self):
         return {
             "size": self.map.size,
-            "map": self.map.map,
+            "map": self.map.tolist(),
             "fps": GAME_SPEED,
             "timeout": TIMEOUT,
             "lives": LIVES,
@@ -0,0 +1,69 @@
+"""Best scores of the server, saved to file without holding up the games."""
+import asyncio
+import bisect
+import json
+import os
+import os.path
+
+
+class Highscores:
+    """The size best (player, score) pairs, best first.
+
+    Scores are kept sorted as they are added, a new score goes after the
+    equal ones already there. Whenever the list changes it is written to
+    path from an executor thread, to a temporary file renamed over the old
+    one so that a crash never leaves a truncated file. Changes made while a
+    write is running are saved together by a single write after it.
+    """
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self._scores = []
+        self._dirty = False
+        self._saving = None
+
+        if os.path.isfile(path):
+            with open(path, "r") as infile:
+                self._scores = [tuple(s) for s in json.load(infile)][:size]
+
+    def __iter__(self):
+        return iter(self._scores)
+
+    def __len__(self):
+        return len(self._scores)
+
+    def tolist(self):
+        return list(self._scores)
+
+    def add(self, player, score):
+        """Add a score, returning whether it made it to the list."""
+        index = bisect.bisect_right(self._scores, -score, key=lambda s: -s[1])
+        if index >= self.size:
+            return False
+        self._scores.insert(index, (player, score))
+        del self._scores[self.size :]
+
+        self._dirty = True
+        if self._saving is None or self._saving.done():
+            self._saving = asyncio.create_task(self._save())
+        return True
+
+    async def flush(self):
+        """Wait for the changes made so far to be on disk."""
+        while self._saving is not None and not self._saving.done():
+            await self._saving
+
+    async def _save(self):
+        loop = asyncio.get_running_loop()
+        while self._dirty:
+            self._dirty = False
+            await loop.run_in_executor(None, self._write, self.tolist())
+
+    def _write(self, scores):
+        temp = f"{self.path}.tmp"
+        with open(temp, "w") as outfile:
+            json.dump(scores, outfile)
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        os.replace(temp, self.path)
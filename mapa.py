@@ -7,6 +7,12 @@ from consts import Direction, Tiles, VITAL_SPACE, MIN_CORRIDOR_LEN
 logger = logging.getLogger("Map")
 logger.setLevel(logging.INFO)
 
+OUTSIDE = 0xFF  # padding around the map, blocked even when traversing
+DELTAS = ((0, -1), (1, 0), (0, 1), (-1, 0))  # indexed by Direction
+PASSAGE = bytes([Tiles.PASSAGE])
+STONE = bytes([Tiles.STONE])
+UNREACHABLE = 1 << 30
+
 
 class Map:
     def __init__(
@@ -27,6 +33,19 @@ class Map:
         self.ver_tiles = size[1]
         self._rocks = rocks
         self._digged = []
+
+        # tiles are stored column by column in a flat buffer with a one tile
+        # border of OUTSIDE, so that a neighbour is always a valid index
+        self._stride = self.ver_tiles + 2
+        self._grid = bytearray([OUTSIDE]) * ((self.hor_tiles + 2) * self._stride)
+        self._offsets = (-1, self._stride, 1, -self._stride)  # indexed by Direction
+        self._columns = self._make_columns()
+        self._frozen = None  # shared by snapshots until the next dig
+
+        # distance field through the passages, see distance()
+        self._source = None
+        self._distances = None
+
         if enemies_spawn:
             self._enemies_spawn = enemies_spawn
         else:
@@ -34,20 +53,22 @@ class Map:
 
         if not mapa:
             logger.info("Generating a MAP")
-            self.map = [[Tiles.STONE] * self.ver_tiles for i in range(self.hor_tiles)]
-            for x in range(self.hor_tiles):
-                for y in range(self.ver_tiles):
-                    if y in range(0, 2):
-                        self.map[x][y] = Tiles.PASSAGE
-                    elif x in [0, self.hor_tiles - 1] or y in [0, self.ver_tiles - 1]:
-                        self.map[x][y] = Tiles.STONE
-                    elif x % 2 == 0 and y % 2 == 0:
-                        self.map[x][y] = Tiles.STONE
-                    elif (
-                        x >= VITAL_SPACE and y >= VITAL_SPACE and not empty
-                    ):  # give dig dug some room
-                        if random.randint(0, 100) > 70 + 25 / level:
-                            self.map[x][y] = Tiles.STONE
+            # the top two rows are open sky and everything below is stone:
+            # the border, the even-grid pillars and the random fill all set
+            # STONE, so every column is the same template
+            template = PASSAGE * 2 + STONE * (self.ver_tiles - 2)
+            for column in self._columns:
+                column[:] = template
+
+            if not empty:
+                # the random fill can only pick STONE, which the template
+                # already has, but its draws are kept so that a given seed
+                # still generates the same caves and rocks. This consumes
+                # the generator exactly like random.randint(0, 100) would.
+                getrandbits = random.getrandbits
+                for _ in range(self._fill_draws()):
+                    while getrandbits(7) > 100:
+                        pass
 
             # create caves for enemies
             for e in range(self._level + 2):
@@ -55,42 +76,73 @@ class Map:
                     # horizontal
                     line = random.randrange(VITAL_SPACE + 1, self.ver_tiles)
                     offset = random.randrange(0, self.hor_tiles - MIN_CORRIDOR_LEN)
-                    for x in range(MIN_CORRIDOR_LEN):
-                        self.map[offset + x][line] = Tiles.PASSAGE
+                    start = self._index((offset, line))
+                    self._grid[
+                        start : start + MIN_CORRIDOR_LEN * self._stride : self._stride
+                    ] = PASSAGE * MIN_CORRIDOR_LEN
                     self._enemies_spawn.append((offset, line))
                     logger.debug(f"Spawn enemy at ({offset}, {line})")
                 else:
                     # vertical
                     column = random.randrange(0, self.hor_tiles)
                     offset = random.randrange(3, self.ver_tiles - MIN_CORRIDOR_LEN)
-                    for y in range(MIN_CORRIDOR_LEN):
-                        self.map[column][offset + y] = Tiles.PASSAGE
+                    self._columns[column][offset : offset + MIN_CORRIDOR_LEN] = (
+                        PASSAGE * MIN_CORRIDOR_LEN
+                    )
                     self._enemies_spawn.append((column, offset))
                     logger.debug(f"Spawn enemy at ({column}, {offset})")
 
-            # create rocks
+            # create rocks, uniformly over the stone tiles of the rock band
             if not self._rocks:
-                self._rocks = []
-                for r in range(self._level):
-                    x, y = random.randrange(0, self.hor_tiles), random.randrange(
-                        VITAL_SPACE + 1, self.ver_tiles - VITAL_SPACE
-                    )
-                    while self.map[x][y] != Tiles.STONE:
-                        x, y = random.randrange(0, self.hor_tiles), random.randrange(
-                            VITAL_SPACE + 1, self.ver_tiles - VITAL_SPACE
-                        )
-                    self._rocks.append((x, y))
+                candidates = self._rock_candidates()
+                self._rocks = [random.choice(candidates) for r in range(self._level)]
         else:
             logger.info("Loading MAP")
-            self.map = mapa
+            for column, tiles in zip(self._columns, mapa):
+                column[:] = bytes(tiles)
 
         self._digdug_spawn = (1, 1)  # Always true
 
+    def _fill_draws(self):
+        """Number of tiles the random fill used to draw a number for."""
+        xs = range(max(VITAL_SPACE, 1), self.hor_tiles - 1)
+        ys = range(max(VITAL_SPACE, 2), self.ver_tiles - 1)
+        pillars = len([x for x in xs if x % 2 == 0]) * len([y for y in ys if y % 2 == 0])
+        return len(xs) * len(ys) - pillars
+
+    def _rock_candidates(self):
+        top, bottom = VITAL_SPACE + 1, self.ver_tiles - VITAL_SPACE
+        stone = int(Tiles.STONE)
+        return [
+            (x, y)
+            for x, column in enumerate(self._columns)
+            for y, tile in enumerate(column[top:bottom], top)
+            if tile == stone
+        ]
+
+    def _make_columns(self):
+        view = memoryview(self._grid)
+        return [
+            view[(x + 1) * self._stride + 1 : (x + 2) * self._stride - 1]
+            for x in range(self.hor_tiles)
+        ]
+
     def __getstate__(self):
-        return self.map
+        state = self.__dict__.copy()
+        del state["_columns"]  # memoryviews can't be pickled, rebuilt on load
+        return state
 
     def __setstate__(self, state):
-        self.map = state
+        self.__dict__.update(state)
+        self._columns = self._make_columns()
+
+    @property
+    def map(self):
+        """Columns of tiles, map[x][y] reads and writes the underlying grid."""
+        return self._columns
+
+    def tolist(self):
+        return [column.tolist() for column in self._columns]
 
     @property
     def size(self):
@@ -120,43 +172,96 @@ class Map:
     def digged(self):
         return self._digged
 
-    def get_tile(self, pos):
+    def _index(self, pos):
         x, y = pos
-        return self.map[x][y]
+        return (x + 1) * self._stride + y + 1
+
+    def get_tile(self, pos):
+        return Tiles(self._grid[self._index(pos)])
 
     def dig(self, pos):
-        x, y = pos
-        if self.map[x][y] == Tiles.STONE:
-            self.map[x][y] = Tiles.PASSAGE
-            self._digged.append((x, y))
+        i = self._index(pos)
+        if self._grid[i] == Tiles.STONE:
+            self._grid[i] = Tiles.PASSAGE
+            self._digged.append(tuple(pos))
+            self._frozen = None
+            self._source = None  # the distance field is out of date
 
     def is_blocked(self, pos, traverse):
         x, y = pos
-        if x not in range(self.hor_tiles) or y not in range(self.ver_tiles):
+        if not (0 <= x < self.hor_tiles and 0 <= y < self.ver_tiles):
             return True
-        if self.map[x][y] == Tiles.PASSAGE:
+        tile = self._grid[self._index(pos)]
+        if tile == Tiles.PASSAGE:
             return False
-        if self.map[x][y] == Tiles.STONE:
-            if traverse:
-                return False
-            else:
-                return True
+        if tile == Tiles.STONE:
+            return not traverse
         assert False, "Unknown tile type"
 
     def calc_pos(self, cur, direction: Direction, traverse=True):
+        if direction is None:
+            return cur
+
+        # cur is always inside the map, so thanks to the border its
+        # neighbour is a valid index and needs no bounds check
         cx, cy = cur
-        npos = cur
-        if direction == Direction.NORTH:
-            npos = cx, cy - 1
-        if direction == Direction.WEST:
-            npos = cx - 1, cy
-        if direction == Direction.SOUTH:
-            npos = cx, cy + 1
-        if direction == Direction.EAST:
-            npos = cx + 1, cy
-
-        # test blocked
-        if self.is_blocked(npos, traverse):
+        tile = self._grid[(cx + 1) * self._stride + cy + 1 + self._offsets[direction]]
+        if tile != Tiles.PASSAGE and (tile != Tiles.STONE or not traverse):
             return cur
 
-        return npos
+        dx, dy = DELTAS[direction]
+        return cx + dx, cy + dy
+
+    def snapshot(self):
+        """Immutable copy of the tiles and digs, shared until the next dig."""
+        if self._frozen is None:
+            self._frozen = (bytes(self._grid), tuple(self._digged))
+        return self._frozen
+
+    def restore(self, snapshot):
+        if snapshot is self._frozen:
+            return  # nothing was dug since
+        grid, digged = snapshot
+        self._grid[:] = grid
+        self._digged = list(digged)
+        self._frozen = snapshot
+        self._source = None
+
+    def distance(self, source, pos):
+        """Steps from source to pos walking only through passages.
+
+        Returns None if there is no such path. The distance field of the last
+        source is kept until the source changes or a tile is dug, so all the
+        enemies chasing Dig Dug in a frame share one search. Dig Dug digs as
+        he moves, so the field is searched again once per move.
+        """
+        if source != self._source:
+            self._search(source)
+
+        distance = self._distances[self._index(pos)]
+        if distance == UNREACHABLE:
+            return None
+        return distance
+
+    def _search(self, source):
+        grid, offsets = self._grid, self._offsets
+        passage = int(Tiles.PASSAGE)
+        distances = [UNREACHABLE] * len(grid)
+
+        start = self._index(source)
+        distances[start] = 0
+        frontier = [start]
+        steps = 0
+        while frontier:
+            steps += 1
+            next_frontier = []
+            for i in frontier:
+                for offset in offsets:
+                    j = i + offset
+                    if distances[j] == UNREACHABLE and grid[j] == passage:
+                        distances[j] = steps
+                        next_frontier.append(j)
+            frontier = next_frontier
+
+        self._source = tuple(source)
+        self._distances = distances
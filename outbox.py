@@ -0,0 +1,129 @@
+"""Game results waiting to be submitted to the grading server."""
+import asyncio
+import itertools
+import json
+import logging
+import os.path
+import uuid
+
+import requests
+from requests import RequestException
+
+logger = logging.getLogger("Outbox")
+logger.setLevel(logging.INFO)
+
+SPOOL_FILE = "grading_outbox.jsonl"
+BATCH = 20  # results submitted before checking for new ones
+BACKOFF = 1  # seconds to wait after the first failure, doubled on every other
+MAX_BACKOFF = 60
+TIMEOUT = 2
+
+
+class Outbox:
+    """Submit results to url in the background, without ever blocking the game.
+
+    put() appends the result to an append-only spool file and returns right
+    away. A task, run(), posts the results in order from a thread, retrying
+    with exponential backoff while the grading server is failing. Submitted
+    results are marked in the spool, results left unsent when the server
+    stops are submitted again on the next start. The spool is emptied once
+    everything is sent.
+    """
+
+    def __init__(
+        self,
+        url,
+        spool=SPOOL_FILE,
+        batch=BATCH,
+        backoff=BACKOFF,
+        max_backoff=MAX_BACKOFF,
+    ):
+        self.url = url
+        self.spool = spool
+        self.batch = batch
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._pending = {}  # result by id, in the order they were put
+        self._ready = asyncio.Event()
+        self._replay()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def put(self, record):
+        id = uuid.uuid4().hex
+        self._pending[id] = record
+        self._append({"id": id, "record": record})
+        self._ready.set()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        backoff = self.backoff
+        with requests.Session() as http:
+            while True:
+                if not self._pending:
+                    self._compact()
+                    self._ready.clear()
+                    await self._ready.wait()
+
+                batch = list(itertools.islice(self._pending.items(), self.batch))
+                sent = await loop.run_in_executor(None, self._submit, http, batch)
+                for id in sent:
+                    del self._pending[id]
+                self._append(*({"sent": id} for id in sent))
+
+                if len(sent) < len(batch):
+                    logger.warning(
+                        "Could not save %d scores to server, retrying in %ss",
+                        len(self._pending),
+                        backoff,
+                    )
+                    await asyncio.sleep(backoff)
+                    backoff = min(backoff * 2, self.max_backoff)
+                else:
+                    backoff = self.backoff
+
+    def _submit(self, http, batch):
+        """Post results in order until one fails, returning the ids sent."""
+        sent = []
+        for id, record in batch:
+            try:
+                response = http.post(self.url, json=record, timeout=TIMEOUT)
+            except RequestException as err:
+                logger.error(err)
+                break
+            if response.status_code >= 500:
+                logger.error("Grading server failed: %s", response.status_code)
+                break
+            if response.status_code >= 400:  # would fail again, give up on it
+                logger.error("Grading server refused %s: %s", record, response.status_code)
+            sent.append(id)
+        return sent
+
+    def _replay(self):
+        if not os.path.isfile(self.spool):
+            return
+        with open(self.spool, "r") as infile:
+            for line in infile:
+                try:
+                    entry = json.loads(line)
+                except ValueError:  # cut short by a crash
+                    continue
+                if "sent" in entry:
+                    self._pending.pop(entry["sent"], None)
+                else:
+                    self._pending[entry["id"]] = entry["record"]
+        if self._pending:
+            logger.info("%d scores left to save from last run", len(self._pending))
+            self._ready.set()
+
+    def _append(self, *entries):
+        if not entries:
+            return
+        with open(self.spool, "a") as outfile:
+            for entry in entries:
+                outfile.write(json.dumps(entry) + "\n")
+
+    def _compact(self):
+        if os.path.isfile(self.spool) and os.path.getsize(self.spool):
+            open(self.spool, "w").close()
@@ -0,0 +1,109 @@
+"""Pacing policies deciding when the game computes its next frame."""
+import asyncio
+import statistics
+from collections import deque
+
+HISTORY = 3000  # ticks kept for statistics, a whole level at the default timeout
+
+
+class TickScheduler:
+    """Tick at fixed absolute deadlines, fps times per second.
+
+    Time spent between two ticks (computing the frame, encoding and sending
+    it) is taken out of the wait instead of being added to it, so the rate
+    doesn't drift under load. A late tick runs right away to catch up, but
+    once more than max_lag periods behind the missed ticks are skipped.
+    Lateness and compute time of every tick are recorded.
+    """
+
+    def __init__(self, fps, max_lag=2):
+        self.period = 1.0 / fps
+        self.max_lag = max_lag
+        self.ticks = 0
+        self.skipped = 0
+        self.lateness = deque(maxlen=HISTORY)
+        self.compute = deque(maxlen=HISTORY)
+        self._deadline = None
+        self._tick_start = None
+
+    async def wait(self):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        if self._tick_start is not None:
+            self.compute.append(now - self._tick_start)
+
+        if self._deadline is None:
+            self._deadline = now + self.period
+        else:
+            self._deadline += self.period
+            behind = now - self._deadline
+            if behind > self.max_lag * self.period:
+                missed = int(behind // self.period)
+                self._deadline += missed * self.period
+                self.skipped += missed
+
+        # always yield, so that a late tick still lets key presses in
+        await asyncio.sleep(max(0.0, self._deadline - now))
+
+        self._tick_start = loop.time()
+        self.ticks += 1
+        self.lateness.append(self._tick_start - self._deadline)
+
+    def answered(self):
+        pass  # the rate is fixed, whatever the player does
+
+    def summary(self):
+        if not self.lateness:
+            return {"ticks": 0, "skipped": self.skipped}
+        compute = self.compute or [0.0]
+        return {
+            "ticks": self.ticks,
+            "skipped": self.skipped,
+            "lateness_mean": statistics.mean(self.lateness),
+            "lateness_max": max(self.lateness),
+            "compute_mean": statistics.mean(compute),
+            "compute_max": max(compute),
+        }
+
+
+class LockstepScheduler:
+    """Tick as soon as the player answers the previous frame, for offline runs.
+
+    The player answers by pressing a key (an empty one will do). A player
+    that takes longer than max_wait misses the tick, which runs without its
+    key, just like a player slower than the frame rate does with fixed rate
+    ticks. With max_wait set to the period of the production frame rate
+    the game plays out the same for an agent, only without idle time. The
+    time players take to answer is recorded.
+    """
+
+    def __init__(self, max_wait):
+        self.max_wait = max_wait
+        self.ticks = 0
+        self.timeouts = 0
+        self.answer = deque(maxlen=HISTORY)
+        self._answered = asyncio.Event()
+
+    def answered(self):
+        self._answered.set()
+
+    async def wait(self):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        try:
+            await asyncio.wait_for(self._answered.wait(), self.max_wait)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+        self._answered.clear()
+        self.answer.append(loop.time() - start)
+        self.ticks += 1
+
+    def summary(self):
+        if not self.answer:
+            return {"ticks": 0, "timeouts": self.timeouts}
+        return {
+            "ticks": self.ticks,
+            "timeouts": self.timeouts,
+            "answer_mean": statistics.mean(self.answer),
+            "answer_max": max(self.answer),
+        }
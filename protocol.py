@@ -0,0 +1,367 @@
+"""Encodings of the game state frames sent to clients."""
+import itertools
+import json
+import struct
+
+from consts import Tiles
+
+ENTITIES = ("enemies", "rocks")
+
+# Binary records, all little endian, starting with their kind
+FRAME = 1
+INFO = 2
+# kind, level, step, timeout, score, lives, digdug x and y, number of enemies
+# and of rocks, rope (0 or 1) and ts; followed by the player name (a byte
+# for its length), the enemies, the rocks and the rope
+FRAME_HEADER = struct.Struct("<BHHHIBBBBBBd")
+# id, name (index in ENEMY_NAMES), x, y, dir, traverse and length of the fire,
+# followed by the positions of the fire, x and y
+ENEMY = struct.Struct("<HBBBBBB")
+ROCK = struct.Struct("<HBB")  # id, x, y
+ROPE = struct.Struct("<BB")  # dir and length, followed by its positions
+POSITION = struct.Struct("<BB")
+# kind, width, height, fps, timeout, lives, score, level; followed by the
+# tiles, one byte each, column after column, and possibly by a FRAME record
+INFO_HEADER = struct.Struct("<BHHBHBIH")
+INFO_FIELDS = {"size", "map", "fps", "timeout", "lives", "score", "level"}
+# appended to a frame by a reporting Channel: coalesced and queue
+REPORT = struct.Struct("<HH")
+
+ENEMY_NAMES = ("Pooka", "Fygar")
+NO_DIRECTION = 0xFF
+
+
+class DeltaEncoder:
+    """Turn full game states into keyframes and deltas.
+
+    Every keyframe_interval frames, and whenever a level starts, the full
+    state is sent with "keyframe" set and every tile dug so far. In between
+    only what changed since the previous frame is sent with "delta" set:
+    the top level fields that changed (None for a removed field), the
+    changed fields of enemies and rocks keyed by id (new ones in full), the
+    ids that are gone in "removed" and the newly dug tiles in "digged".
+    """
+
+    def __init__(self, keyframe_interval):
+        self.keyframe_interval = keyframe_interval
+        self._last = None
+        self._frames = 0
+        self._digged = 0
+
+    def encode(self, state, digged):
+        """Frame for state, digged being the list of tiles dug in the level."""
+        keyframe = (
+            self._last is None
+            or self._frames % self.keyframe_interval == 0
+            or state.get("level") != self._last.get("level")
+            or len(digged) < self._digged
+        )
+        if keyframe:
+            frame = {**state, "keyframe": True, "digged": list(digged)}
+        else:
+            frame = self._delta(self._last, state)
+            if len(digged) > self._digged:
+                frame["digged"] = digged[self._digged :]
+
+        self._last = state
+        self._frames += 1
+        self._digged = len(digged)
+        return frame
+
+    @staticmethod
+    def _delta(last, state):
+        frame = {"delta": True}
+        for key, value in state.items():
+            if key not in ENTITIES and last.get(key) != value:
+                frame[key] = value
+        for key in last.keys() - state.keys():
+            frame[key] = None
+
+        removed = []
+        for key in ENTITIES:
+            previous = {e["id"]: e for e in last.get(key, [])}
+            changes = {}
+            for entity in state.get(key, []):
+                before = previous.pop(entity["id"], None)
+                if before is None:
+                    changes[entity["id"]] = entity
+                    continue
+                change = {f: v for f, v in entity.items() if before.get(f) != v}
+                change.update({f: None for f in before.keys() - entity.keys()})
+                if change:
+                    changes[entity["id"]] = change
+            if changes:
+                frame[key] = changes
+            removed.extend(previous)
+        if removed:
+            frame["removed"] = removed
+        return frame
+
+
+class DeltaDecoder:
+    """Rebuild full game states from the frames of a DeltaEncoder.
+
+    Messages that are neither keyframes nor deltas, like the level info, are
+    returned as they are. Deltas received before the first keyframe can't
+    be applied and decode to None. Decoded states carry the tiles dug since
+    the previous frame in "digged", every tile dug so far for a keyframe.
+    """
+
+    def __init__(self):
+        self._state = None
+        self._entities = None
+
+    def decode(self, frame):
+        if frame.pop("keyframe", False):
+            self._state = frame
+            self._entities = {
+                key: {e["id"]: e for e in frame.get(key, [])} for key in ENTITIES
+            }
+            return self._render(frame.pop("digged", []))
+
+        if not frame.pop("delta", False):
+            return frame
+
+        if self._state is None:
+            return None  # joined in the middle of the stream, wait for a keyframe
+
+        digged = frame.pop("digged", [])
+        for id in frame.pop("removed", []):
+            for entities in self._entities.values():
+                entities.pop(id, None)
+
+        for key, value in frame.items():
+            if key in ENTITIES:
+                entities = self._entities[key]
+                for id, change in value.items():
+                    entity = {**entities.get(id, {}), **change}
+                    entities[id] = {f: v for f, v in entity.items() if v is not None}
+            elif value is None:
+                self._state.pop(key, None)
+            else:
+                self._state[key] = value
+
+        return self._render(digged)
+
+    def _render(self, digged):
+        state = dict(self._state)
+        for key, entities in self._entities.items():
+            state[key] = list(entities.values())
+        state["digged"] = digged
+        return state
+
+
+class BinaryEncoder:
+    """Pack game states into FRAME records.
+
+    Entities get small integer ids, in the order they are first seen, in
+    place of their uuid.
+    """
+
+    def __init__(self):
+        self._ids = {}
+
+    def _id(self, uuid):
+        return self._ids.setdefault(uuid, len(self._ids) & 0xFFFF)
+
+    def encode(self, state):
+        enemies, rocks = state["enemies"], state["rocks"]
+        rope = state.get("rope")
+        player = state.get("player", "").encode()[:255]
+        parts = [
+            FRAME_HEADER.pack(
+                FRAME,
+                state["level"],
+                state["step"],
+                state["timeout"],
+                state["score"],
+                state["lives"],
+                *state["digdug"],
+                len(enemies),
+                len(rocks),
+                rope is not None,
+                state.get("ts", 0.0),
+            ),
+            bytes([len(player)]),
+            player,
+        ]
+        for enemy in enemies:
+            fire = enemy.get("fire", ())
+            parts.append(
+                ENEMY.pack(
+                    self._id(enemy["id"]),
+                    ENEMY_NAMES.index(enemy["name"]),
+                    *enemy["pos"],
+                    NO_DIRECTION if enemy["dir"] is None else enemy["dir"],
+                    enemy.get("traverse", False),
+                    len(fire),
+                )
+            )
+            parts.extend(POSITION.pack(*pos) for pos in fire)
+        for rock in rocks:
+            parts.append(ROCK.pack(self._id(rock["id"]), *rock["pos"]))
+        if rope is not None:
+            parts.append(ROPE.pack(rope["dir"], len(rope["pos"])))
+            parts.extend(POSITION.pack(*pos) for pos in rope["pos"])
+        return b"".join(parts)
+
+
+def encode_info(info):
+    """Level info as an INFO record, None if it has fields the record lacks."""
+    if info.keys() != INFO_FIELDS:
+        return None
+    width, height = info["size"]
+    header = INFO_HEADER.pack(
+        INFO,
+        width,
+        height,
+        info["fps"],
+        info["timeout"],
+        info["lives"],
+        info["score"],
+        info["level"],
+    )
+    return header + bytes(itertools.chain.from_iterable(info["map"]))
+
+
+class LevelSnapshot:
+    """Level info for viewers joining in the middle of a level.
+
+    The map of the info is kept up to date with the tiles dug, and the
+    latest frame, as sent, is kept too. messages() gives the info with the
+    latest frame in "state", as JSON and as a binary record. The info is
+    serialized again only after new tiles are dug, the frame never is.
+    """
+
+    def __init__(self, info):
+        self.info = {**info, "map": [list(column) for column in info["map"]]}
+        self.frame = None
+        self.binary_frame = None
+        self._encoded = None
+
+    def update(self, frame, binary_frame=None, digged=()):
+        """Keep the latest frame and apply the tiles dug since the last one."""
+        self.frame = frame
+        self.binary_frame = binary_frame
+        tiles = self.info["map"]
+        for x, y in digged:
+            if tiles[x][y] != Tiles.PASSAGE:
+                tiles[x][y] = Tiles.PASSAGE
+                self._encoded = None
+
+    def messages(self):
+        if self._encoded is None:
+            info = json.dumps(self.info)
+            self._encoded = info, encode_info(self.info) or info
+
+        info, binary_info = self._encoded
+        if self.frame is not None:
+            # a JSON object, append the frame before the last brace
+            info = f'{info[:-1]}, "state": {self.frame}}}'
+        if self.binary_frame is not None and isinstance(binary_info, bytes):
+            binary_info += self.binary_frame
+        return info, binary_info
+
+
+def decode(message):
+    """Message from the server, binary records or JSON, as a dict."""
+    if isinstance(message, str):
+        return json.loads(message)
+    if message[0] == INFO:
+        return _decode_info(message)
+    return _decode_frame(message)
+
+
+def _decode_info(data):
+    _, width, height, fps, timeout, lives, score, level = INFO_HEADER.unpack_from(data)
+    end = INFO_HEADER.size + width * height
+    tiles = data[INFO_HEADER.size : end]
+    info = {
+        "size": [width, height],
+        "map": [list(tiles[x * height : (x + 1) * height]) for x in range(width)],
+        "fps": fps,
+        "timeout": timeout,
+        "lives": lives,
+        "score": score,
+        "level": level,
+    }
+    if len(data) > end:
+        info["state"] = _decode_frame(data[end:])
+    return info
+
+
+def _decode_frame(data):
+    (
+        _,
+        level,
+        step,
+        timeout,
+        score,
+        lives,
+        x,
+        y,
+        n_enemies,
+        n_rocks,
+        has_rope,
+        ts,
+    ) = FRAME_HEADER.unpack_from(data)
+    offset = FRAME_HEADER.size
+    length = data[offset]
+    player = data[offset + 1 : offset + 1 + length].decode()
+    offset += 1 + length
+
+    def positions(n):
+        nonlocal offset
+        pos = [list(p) for p in POSITION.iter_unpack(data[offset : offset + 2 * n])]
+        offset += 2 * n
+        return pos
+
+    enemies = []
+    for _ in range(n_enemies):
+        id, name, ex, ey, direction, traverse, fire = ENEMY.unpack_from(data, offset)
+        offset += ENEMY.size
+        enemy = {
+            "name": ENEMY_NAMES[name],
+            "id": id,
+            "pos": [ex, ey],
+            "dir": None if direction == NO_DIRECTION else direction,
+        }
+        if fire:
+            enemy["fire"] = positions(fire)
+        if traverse:
+            enemy["traverse"] = True
+        enemies.append(enemy)
+
+    rocks = []
+    for _ in range(n_rocks):
+        id, rx, ry = ROCK.unpack_from(data, offset)
+        offset += ROCK.size
+        rocks.append({"id": id, "pos": [rx, ry]})
+
+    state = {
+        "level": level,
+        "step": step,
+        "timeout": timeout,
+        "player": player,
+        "score": score,
+        "lives": lives,
+        "digdug": [x, y],
+        "enemies": enemies,
+        "rocks": rocks,
+    }
+    if has_rope:
+        direction, length = ROPE.unpack_from(data, offset)
+        offset += ROPE.size
+        state["rope"] = {"dir": direction, "pos": positions(length)}
+    state["ts"] = ts
+    if len(data) - offset == REPORT.size:
+        state["coalesced"], state["queue"] = REPORT.unpack_from(data, offset)
+    return state
+
+
+def report(message, coalesced, queue):
+    """Frame message with the fields added by a reporting Channel."""
+    if isinstance(message, bytes):
+        return message + REPORT.pack(min(coalesced, 0xFFFF), min(queue, 0xFFFF))
+    # JSON objects, append the fields before the last brace
+    return f'{message[:-1]}, "coalesced": {coalesced}, "queue": {queue}}}'
@@ -5,17 +5,21 @@ import asyncio
 from datetime import datetime
 import json
 import logging
-import os.path
 import random
 from collections import namedtuple
 from typing import Any, Dict, Set
 
-import requests
 import websockets
-from requests import RequestException
+from websockets.extensions.permessage_deflate import ServerPerMessageDeflateFactory
 from websockets.legacy.protocol import WebSocketCommonProtocol
+from websockets.legacy.server import WebSocketServerProtocol
 
+from channel import Channel
 from game import Game
+from highscores import Highscores
+from outbox import Outbox
+from pacing import LockstepScheduler
+from protocol import BinaryEncoder, DeltaEncoder, LevelSnapshot, encode_info
 
 logging.basicConfig(
     level=logging.DEBUG, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
@@ -26,67 +30,138 @@ wslogger.setLevel(logging.WARN)
 logger = logging.getLogger("Server")
 logger.setLevel(logging.INFO)
 
-Player = namedtuple("Player", ["name", "ws"])
+Player = namedtuple("Player", ["name", "ws", "coalesce"], defaults=[False])
 
 HIGHSCORE_FILE = "highscores.json"
 MAX_HIGHSCORES = 10
 
+# Viewers get compressed messages, the level info and frames repeat a lot from
+# one message to the next. Smaller windows than the default 32KB keep the
+# memory per viewer low while still spanning a level info.
+VIEWER_COMPRESSION = ServerPerMessageDeflateFactory(
+    server_max_window_bits=13,
+    client_max_window_bits=13,
+    compress_settings={"memLevel": 5},
+)
+
+
+class GameServerProtocol(WebSocketServerProtocol):
+    """Compress the messages to viewers only, players get frames sooner without."""
+
+    def process_extensions(self, headers, available_extensions):
+        if self.path != "/viewer":
+            available_extensions = None
+        return super().process_extensions(headers, available_extensions)
+
+
+class Session:
+    """A game, the player playing it and the viewers watching it."""
+
+    def __init__(self, player: Player, pacing=None):
+        self.player = player
+        self.game = Game(pacing=pacing)
+        self.viewers: Set[WebSocketCommonProtocol] = set()
+        self.snapshot = None  # of the current level, for viewers joining
+
+    def keypress(self, key: str):
+        self.game.keypress(key)
+
 
 class GameServer:
     """Network Game Server."""
 
-    def __init__(self, level: int, timeout: int, seed: int = 0, grading: str = None, dbg: bool = False):
+    def __init__(
+        self,
+        level: int,
+        timeout: int,
+        seed: int = 0,
+        grading: str = None,
+        dbg: bool = False,
+        delta: int = 0,
+        sessions: int = 1,
+        lockstep: float = None,
+    ):
         """Initialize Gameserver."""
         self.dbg = dbg
+        self.delta = delta  # keyframe interval of delta frames, 0 disables them
         self.seed = seed
-        self.game = Game()
         self.players: asyncio.Queue[Player] = asyncio.Queue()
-        self.viewers: Set[WebSocketCommonProtocol] = set()
-        self.current_player: Player | None = None
-        self.grading = grading
+        self.sessions: Dict[WebSocketCommonProtocol, Session] = {}  # by player ws
+        self.viewers: Set[WebSocketCommonProtocol] = set()  # waiting for a game
+        self.watching: Dict[WebSocketCommonProtocol, str] = {}  # player of viewers
+        self.channels: Dict[WebSocketCommonProtocol, Channel] = {}  # of viewers
+        self.binary: Set[WebSocketCommonProtocol] = set()  # sent binary records
+        self.outbox = Outbox(grading) if grading else None
         self._level = level  # game level
         self._timeout = timeout  # timeout for game
+        self._slots = asyncio.Semaphore(sessions)  # games played at the same time
+        self._games: Set[asyncio.Task] = set()  # the tasks playing them
+        self.lockstep = lockstep  # max wait for the player, None for a fixed rate
 
-        self._highscores = []
-        if os.path.isfile(HIGHSCORE_FILE):
-            with open(HIGHSCORE_FILE, "r") as infile:
-                self._highscores = json.load(infile)
+        if seed > 0 and sessions > 1:
+            logger.warning("Games played at the same time share the seeded random generator")
 
-    def save_highscores(self, score: int):
-        """Update highscores, storing to file."""
-        if not self.current_player:
-            raise Exception("Can't save highscores without current player")
+        self._highscores = Highscores(HIGHSCORE_FILE, MAX_HIGHSCORES)
 
+    def save_highscores(self, player: str, score: int):
+        """Update highscores, stored to file in the background."""
         logger.debug("Save highscores")
         logger.info(
             "Saving: %s <%s>",
-            self.current_player.name,
+            player,
             score,
         )
 
-        self._highscores.append((self.current_player.name, score))
-        self._highscores = sorted(self._highscores, key=lambda s: s[1], reverse=True)[
-            :MAX_HIGHSCORES
-        ]
+        self._highscores.add(player, score)
 
-        with open(HIGHSCORE_FILE, "w") as outfile:
-            json.dump(self._highscores, outfile)
+    async def send_info(
+        self, session: Session, game_info: Dict[str, Any], highscores: bool = False
+    ):
+        """Send game info to the viewers and the player of a session."""
 
-    async def send_info(self, game_info: Dict[str, Any], highscores: bool = False):
-        """Send game info to viewer and player."""
+        if highscores:
+            game_info["highscores"] = self._highscores.tolist()
+            game_info["player"] = session.player.name
 
         if highscores:
-            game_info["highscores"] = self._highscores
-            game_info["player"] = self.current_player.name
-
-        for viewer in self.viewers:
-            try:
-                await viewer.send(json.dumps(game_info))
-            except Exception:
-                self.viewers.remove(viewer)
-                break
-        if self.current_player:
-            await self.current_player.ws.send(json.dumps(game_info))
+            message = json.dumps(game_info)
+            binary_message = encode_info(game_info) or message
+        else:  # a new level
+            session.snapshot = LevelSnapshot(game_info)
+            message, binary_message = session.snapshot.messages()
+        for viewer in session.viewers:
+            if viewer in self.binary:
+                self.channels[viewer].send(binary_message)
+            else:
+                self.channels[viewer].send(message)
+        if session.player.ws in self.binary:
+            message = binary_message
+        if session.channel is not None:
+            session.channel.send(message)
+        else:
+            await session.player.ws.send(message)
+
+    def watch(self, viewer: WebSocketCommonProtocol, player: str = None):
+        """Attach a viewer to the game of player, or the oldest game running.
+
+        Without such a game running the viewer waits for the next one.
+        """
+        self.watching[viewer] = player
+        for session in self.sessions.values():
+            if player in (None, session.player.name):
+                session.viewers.add(viewer)
+                return session
+        self.viewers.add(viewer)
+        return None
+
+    def unwatch(self, viewer: WebSocketCommonProtocol):
+        if (channel := self.channels.pop(viewer, None)) is not None:
+            channel.close()
+        self.binary.discard(viewer)
+        self.watching.pop(viewer, None)
+        self.viewers.discard(viewer)
+        for session in self.sessions.values():
+            session.viewers.discard(viewer)
 
     async def incomming_handler(self, websocket: WebSocketCommonProtocol, path: str):
         """Process new clients arriving at the server."""
@@ -96,32 +171,42 @@ class GameServer:
                 if "cmd" not in data:
                     continue
                 if data["cmd"] == "join":
+                    if data.get("binary"):
+                        self.binary.add(websocket)
+
                     if path == "/player":
                         logger.info("<%s> has joined", data["name"])
-                        await self.players.put(Player(data["name"], websocket))
+                        await self.players.put(
+                            Player(data["name"], websocket, bool(data.get("coalesce")))
+                        )
 
                     if path == "/viewer":
                         logger.info("Viewer connected")
-                        self.viewers.add(websocket)
-                        if self.game.running:
-                            game_info = self.game.info()
-                            await websocket.send(json.dumps(game_info))
-
-                if (
-                    data["cmd"] == "key"
-                    and self.current_player
-                    and self.current_player.ws == websocket
-                ):
-                    logger.debug((self.current_player.name, data))
+                        delta = bool(self.delta and data.get("delta"))
+                        if delta:  # delta frames are JSON
+                            self.binary.discard(websocket)
+                        self.channels[websocket] = Channel(websocket, delta)
+                        session = self.watch(websocket, data.get("player"))
+                        if session and session.snapshot:
+                            message, binary_message = session.snapshot.messages()
+                            if websocket in self.binary:
+                                message = binary_message
+                            self.channels[websocket].send(message)
+
+                session = self.sessions.get(websocket)
+                if data["cmd"] == "key" and session:
+                    logger.debug((session.player.name, data))
                     if len(data["key"]) > 0:
-                        self.game.keypress(data["key"][0])
+                        session.keypress(data["key"][0])
                     else:
-                        self.game.keypress("")
+                        session.keypress("")
+                    if session.channel is not None:
+                        session.channel.ack()
 
         except websockets.exceptions.ConnectionClosed as closed_reason:
             logger.info("Client disconnected: %s", closed_reason)
-            if websocket in self.viewers:
-                self.viewers.remove(websocket)
+        finally:
+            self.unwatch(websocket)
 
     def debug_map(self, mapa, digdug, enemies):
         from PIL import Image
@@ -144,73 +229,161 @@ class GameServer:
         img.show()
 
     async def mainloop(self):
-        """Run the game."""
+        """Start a game for every player, as long as there are free slots."""
+        if self.outbox is not None:
+            self._grading = asyncio.create_task(self.outbox.run())
+
         while True:
+            await self._slots.acquire()
             logger.info("Waiting for player")
-            self.current_player = await self.players.get()
+            player = await self.players.get()
 
-            if self.current_player.ws.closed:
-                logger.error("<%s> disconnect while waiting", self.current_player.name)
+            if player.ws.closed:
+                logger.error("<%s> disconnect while waiting", player.name)
+                self._slots.release()
                 continue
 
-            try:
-                logger.info("Starting game for <%s>", self.current_player.name)
-                if self.seed > 0:
-                    random.seed(self.seed)
-
-                self.game = Game()
-                self.game.start(self.current_player.name)
-
-                if self.grading:
-                    game_record = {}
-                    game_record["player"] = self.current_player.name
-
-                while self.game.running:
-                    if self.game._step == 0:  # Starting a level ? Let's send the info
-                        game_info = self.game.info()
-                        await self.send_info(game_info)
-
-                    if state := await self.game.next_frame():
-                        state["player"] = self.current_player.name
-                        state["ts"] = datetime.utcnow().astimezone().timestamp()
-                        state = json.dumps(state)
-
-                        await self.current_player.ws.send(state)
-
-                        for viewer in self.viewers:
-                            try:
-                                await viewer.send(state)
-                            except Exception:
-                                self.viewers.remove(viewer)
-                                break
-
-                        if self.dbg and self.game.respawn:
-                            self.debug_map(self.game.map, self.game._digdug, self.game._enemies)
-
-                self.save_highscores(self.game.score)
-
-                game_info = self.game.info()
-                game_info["player"] = self.current_player.name
-
-                await self.send_info(game_info, highscores=True)
-                await self.current_player.ws.close()
-                self.current_player = None
+            game = asyncio.create_task(self.play(player), name=player.name)
+            self._games.add(game)
+            game.add_done_callback(self._game_done)
+
+    def _game_done(self, game: asyncio.Task):
+        self._games.discard(game)
+        self._slots.release()
+        if not game.cancelled() and game.exception() is not None:
+            logger.error(
+                "Game of <%s> failed", game.get_name(), exc_info=game.exception()
+            )
+
+    def pacing(self):
+        return LockstepScheduler(self.lockstep) if self.lockstep else None
+
+    def attach(self, session):
+        # players asking to coalesce frames only get the newest one not sent yet
+        session.channel = None
+        if session.player.coalesce:
+            session.channel = Channel(
+                session.player.ws, timeout=None, window=1, report=True
+            )
+        self.sessions[session.player.ws] = session
+        # viewers waiting for this player, or for any game, watch this one
+        waiting = {
+            viewer
+            for viewer in self.viewers
+            if self.watching.get(viewer) in (None, session.player.name)
+        }
+        session.viewers |= waiting
+        self.viewers -= waiting
+
+    def detach(self, session):
+        if session.channel is not None:
+            session.channel.close()
+        del self.sessions[session.player.ws]
+        self.viewers |= session.viewers  # back to waiting for a game
+
+    def wants_binary(self, session) -> bool:
+        return bool(self.binary) and (
+            session.player.ws in self.binary or not self.binary.isdisjoint(session.viewers)
+        )
 
-            except websockets.exceptions.ConnectionClosed:
-                self.current_player = None
-            finally:
-                try:
-                    if self.grading:
-                        game_record["score"] = self.game.score
-                        game_record["level"] = self.game.level
-                        requests.post(self.grading, json=game_record, timeout=2)
-                except RequestException as err:
-                    logger.error(err)
-                    logger.warning("Could not save score to server")
+    async def broadcast(
+        self,
+        session,
+        frame: str,
+        delta_frame: str = None,
+        keyframe: bool = True,
+        binary_frame: bytes = None,
+    ):
+        """Send a frame to the player and queue it for the viewers of a session.
+
+        delta_frame and binary_frame are the same frame for delta and binary
+        clients, keyframe whether it is a keyframe.
+        """
+        for viewer in session.viewers:
+            channel = self.channels[viewer]
+            if channel.delta:
+                channel.send_frame(delta_frame, keyframe)
+            elif viewer in self.binary:
+                channel.send_frame(binary_frame)
+            else:
+                channel.send_frame(frame)
+
+        if session.player.ws in self.binary:
+            frame = binary_frame
+        if session.channel is not None:
+            await session.player.ws.ensure_open()  # raises once the player is gone
+            session.channel.send_frame(frame)
+        else:
+            await session.player.ws.send(frame)
+
+    async def game_over(self, session, score: int, game_info: Dict[str, Any]):
+        """Save the score and send the final info, highscores included."""
+        self.save_highscores(session.player.name, score)
+
+        game_info["player"] = session.player.name
+
+        await self.send_info(session, game_info, highscores=True)
+        if session.channel is not None:
+            await session.channel.drain()
+        await session.player.ws.close()
+
+    def grade(self, player: str, score: int, level: int):
+        if self.outbox is not None:
+            self.outbox.put({"player": player, "score": score, "level": level})
+
+    async def play(self, player: Player):
+        """Run the game of a player."""
+        session = Session(player, self.pacing())
+        self.attach(session)
+        game = session.game
+        finished = False
 
-                if self.current_player:
-                    logger.info("Disconnecting <%s>", self.current_player.name)
-                    await self.current_player.ws.close()
+        try:
+            logger.info("Starting game for <%s>", player.name)
+            if self.seed > 0:
+                random.seed(self.seed)
+
+            game.start(player.name)
+            encoder = DeltaEncoder(self.delta) if self.delta else None
+            delta_frame, keyframe = None, True
+            binary = BinaryEncoder()
+
+            while game.running:
+                if game._step == 0:  # Starting a level ? Let's send the info
+                    game_info = game.info()
+                    await self.send_info(session, game_info)
+                    dug = 0
+
+                if state := await game.next_frame():
+                    state["player"] = player.name
+                    state["ts"] = datetime.utcnow().astimezone().timestamp()
+                    frame = json.dumps(state)
+                    if encoder:
+                        encoded = encoder.encode(state, game.map.digged)
+                        delta_frame, keyframe = json.dumps(encoded), "keyframe" in encoded
+                    binary_frame = binary.encode(state) if self.wants_binary(session) else None
+                    digged = game.map.digged
+                    session.snapshot.update(frame, binary_frame, digged[dug:])
+                    dug = len(digged)
+
+                    await self.broadcast(session, frame, delta_frame, keyframe, binary_frame)
+
+                    if self.dbg and game.respawn:
+                        self.debug_map(game.map, game._digdug, game._enemies)
+
+            await self.game_over(session, game.score, game.info())
+            finished = True
+
+        except websockets.exceptions.ConnectionClosed:
+            finished = True
+        finally:
+            self.detach(session)
+            logger.info("Pacing: %s", game.pacing.summary())
+            self.grade(player.name, game.score, game.level)
+
+            if not finished:
+                logger.info("Disconnecting <%s>", player.name)
+                await player.ws.close()
 
 
 if __name__ == "__main__":
@@ -219,6 +392,24 @@ if __name__ == "__main__":
     parser.add_argument("--port", help="TCP port", type=int, default=8000)
     parser.add_argument("--seed", help="Seed number", type=int, default=0)
     parser.add_argument("--debug", help="Open Bitmap with map on gameover", action='store_true')
+    parser.add_argument(
+        "--delta",
+        help="Send viewers a keyframe every DELTA frames and only changes in between",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--sessions", help="Games played at the same time", type=int, default=None
+    )
+    parser.add_argument(
+        "--lockstep",
+        help="Tick as soon as the player answers, or after LOCKSTEP seconds",
+        type=float,
+        default=None,
+    )
+    parser.add_argument(
+        "--workers", help="Play the games in WORKERS processes", type=int, default=0
+    )
     parser.add_argument(
         "--grading-server",
         help="url of grading server",
@@ -228,12 +419,43 @@ if __name__ == "__main__":
 
     async def main():
         """Start server tasks."""
-        g = GameServer(0, -1, args.seed, args.grading_server, args.debug)
+        sessions = args.sessions or args.workers or 1
+        if args.workers:
+            from shard import ShardedGameServer
+
+            g = ShardedGameServer(
+                0,
+                -1,
+                args.seed,
+                args.grading_server,
+                args.debug,
+                args.delta,
+                sessions,
+                args.lockstep,
+                workers=args.workers,
+            )
+        else:
+            g = GameServer(
+                0,
+                -1,
+                args.seed,
+                args.grading_server,
+                args.debug,
+                args.delta,
+                sessions,
+                args.lockstep,
+            )
 
         game_loop_task = asyncio.ensure_future(g.mainloop())
 
         logger.info("Listenning @ %s:%s", args.bind, args.port)
-        websocket_server = websockets.serve(g.incomming_handler, args.bind, args.port)
+        websocket_server = websockets.serve(
+            g.incomming_handler,
+            args.bind,
+            args.port,
+            create_protocol=GameServerProtocol,
+            extensions=[VIEWER_COMPRESSION],
+        )
 
         await asyncio.gather(websocket_server, game_loop_task)
 
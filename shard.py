@@ -0,0 +1,269 @@
+"""Game server front-end running the games in worker processes.
+
+The front-end keeps every websocket, exactly like GameServer, while the
+games are stepped, and their frames encoded, by a pool of worker processes,
+so that simulation and JSON encoding are spread over the cores. Each worker
+is connected to the front-end by a pipe: the front-end sends it commands
+to start and stop games and the keys pressed, the worker sends back the
+info and the frames of its games, already serialized.
+
+Workers are spawned, not forked, so that a worker started while the server
+is running doesn't inherit its sockets. Both ends write to the pipe from a
+thread of their own, see Sender.
+"""
+from __future__ import annotations
+import asyncio
+import itertools
+import json
+import logging
+import multiprocessing
+import queue
+import random
+import threading
+from datetime import datetime
+
+import websockets
+
+from game import Game
+from pacing import LockstepScheduler
+from protocol import BinaryEncoder, DeltaEncoder
+from server import GameServer, Player
+
+logger = logging.getLogger("Shard")
+logger.setLevel(logging.INFO)
+
+CONTEXT = multiprocessing.get_context("spawn")
+
+
+class Sender:
+    """Send to a pipe from a thread, so that the event loop never blocks.
+
+    Messages are queued without limit: if the other end stops reading, the
+    queue grows in memory instead of stalling every game and websocket of
+    this process. Messages sent after the other end is gone are dropped.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._queue = queue.SimpleQueue()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def send(self, message):
+        self._queue.put(message)
+
+    def _run(self):
+        while True:
+            try:
+                self.conn.send(self._queue.get())
+            except OSError:  # the other end is gone
+                return
+
+
+class Worker:
+    """Process running games on behalf of the front-end."""
+
+    def __init__(self, seed: int = 0, delta: int = 0, lockstep: float = None):
+        self.sessions = {}  # RemoteSession by id, of the games running here
+        self.alive = True
+        self.conn, child = CONTEXT.Pipe()
+        self.process = CONTEXT.Process(
+            target=run_worker, args=(child, seed, delta, lockstep), daemon=True
+        )
+        self.process.start()
+        child.close()
+        self.sender = Sender(self.conn)
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def send(self, *command):
+        self.sender.send(command)
+
+    def receive(self):
+        """Deliver the messages waiting in the pipe to their sessions."""
+        while self.conn.poll():
+            try:
+                kind, id, *message = self.conn.recv()
+            except EOFError:  # the process died, its games are over
+                logger.error("Worker %s died", self.process.pid)
+                asyncio.get_running_loop().remove_reader(self.conn.fileno())
+                self.alive = False
+                for session in self.sessions.values():
+                    session.messages.put_nowait(("over", 0, 0, None))
+                return
+            if session := self.sessions.get(id):
+                session.messages.put_nowait((kind, *message))
+
+
+class RemoteSession:
+    """A game played in a Worker, as seen by the front-end."""
+
+    ids = itertools.count()
+
+    def __init__(self, player: Player, worker: Worker):
+        self.id = next(self.ids)
+        self.player = player
+        self.worker = worker
+        self.viewers = set()
+        self.messages: asyncio.Queue = asyncio.Queue()
+        self.snapshot = None  # of the current level, for viewers joining
+
+    def keypress(self, key: str):
+        self.worker.send("key", self.id, key)
+
+
+class ShardedGameServer(GameServer):
+    """GameServer playing its games in worker processes."""
+
+    def __init__(self, *args, workers: int = 2, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.workers = [
+            Worker(self.seed, self.delta, self.lockstep) for _ in range(workers)
+        ]
+
+    async def mainloop(self):
+        loop = asyncio.get_running_loop()
+        for worker in self.workers:
+            loop.add_reader(worker.conn.fileno(), worker.receive)
+        await super().mainloop()
+
+    def worker(self) -> Worker:
+        """The least busy worker, after replacing those that died."""
+        loop = asyncio.get_running_loop()
+        for i, worker in enumerate(self.workers):
+            if not worker.alive:
+                worker = Worker(self.seed, self.delta, self.lockstep)
+                self.workers[i] = worker
+                loop.add_reader(worker.conn.fileno(), worker.receive)
+                logger.info("Started worker %s", worker.process.pid)
+        return min(self.workers, key=len)
+
+    async def play(self, player: Player):
+        """Run the game of a player in the least busy worker."""
+        worker = self.worker()
+        session = RemoteSession(player, worker)
+        worker.sessions[session.id] = session
+        self.attach(session)
+        over = None
+        finished = False
+
+        try:
+            logger.info("Starting game for <%s> in worker %s", player.name, worker.process.pid)
+            worker.send("start", session.id, player.name)
+
+            while over is None:
+                kind, *message = await session.messages.get()
+                if kind == "info":
+                    await self.send_info(session, message[0])
+                elif kind == "frame":
+                    *frames, digged = message
+                    frame, _, _, binary_frame = frames
+                    session.snapshot.update(frame, binary_frame, digged)
+                    await self.broadcast(session, *frames)
+                elif kind == "over":
+                    over = message
+
+            score, _, game_info = over
+            if game_info is not None:  # else the worker died
+                await self.game_over(session, score, game_info)
+                finished = True
+
+        except websockets.exceptions.ConnectionClosed:
+            finished = True
+        finally:
+            if over is None:  # stop the game, it still reports the final score
+                if worker.alive:
+                    worker.send("stop", session.id)
+                over = await self._stopped(session)
+            del worker.sessions[session.id]
+            self.detach(session)
+            if over[2] is not None:
+                self.grade(player.name, *over[:2])
+            else:
+                logger.error("No final score for <%s>, not graded", player.name)
+
+            if not finished:
+                logger.info("Disconnecting <%s>", player.name)
+                await player.ws.close()
+
+    @staticmethod
+    async def _stopped(session, timeout=1):
+        """Final score and level of a stopped game."""
+        try:
+            while True:
+                kind, *message = await asyncio.wait_for(session.messages.get(), timeout)
+                if kind == "over":
+                    return message
+        except asyncio.TimeoutError:
+            logger.error("Worker %s didn't stop the game", session.worker.process.pid)
+            return 0, 0, None
+
+
+def run_worker(conn, seed, delta, lockstep):
+    """Entry point of the worker processes."""
+    asyncio.run(serve_games(conn, seed, delta, lockstep))
+
+
+async def serve_games(conn, seed, delta, lockstep):
+    loop = asyncio.get_running_loop()
+    closed = loop.create_future()
+    sender = Sender(conn)
+    games = {}  # Game by session id
+    tasks = {}
+
+    def receive():
+        while conn.poll():
+            try:
+                command, id, *args = conn.recv()
+            except EOFError:  # the front-end is gone
+                loop.remove_reader(conn.fileno())
+                closed.set_result(None)
+                return
+            if command == "start":
+                tasks[id] = asyncio.create_task(play(id, args[0]))
+            elif command == "key" and id in games:
+                games[id].keypress(args[0])
+            elif command == "stop" and id in games:
+                tasks[id].cancel()
+            elif command == "stop" and id in tasks:  # cancelled before it runs
+                tasks.pop(id).cancel()
+                sender.send(("over", id, 0, 0, None))
+
+    async def play(id, name):
+        pacing = LockstepScheduler(lockstep) if lockstep else None
+        game = games[id] = Game(pacing=pacing)
+        try:
+            if seed > 0:
+                random.seed(seed)
+
+            game.start(name)
+            encoder = DeltaEncoder(delta) if delta else None
+            delta_frame, keyframe = None, True
+            binary = BinaryEncoder()
+
+            while game.running:
+                if game._step == 0:  # starting a level, send the info
+                    sender.send(("info", id, game.info()))
+                    dug = 0
+
+                if state := await game.next_frame():
+                    state["player"] = name
+                    state["ts"] = datetime.utcnow().astimezone().timestamp()
+                    frame = json.dumps(state)
+                    if encoder:
+                        encoded = encoder.encode(state, game.map.digged)
+                        delta_frame, keyframe = json.dumps(encoded), "keyframe" in encoded
+                    binary_frame = binary.encode(state)
+                    digged = game.map.digged[dug:]  # for the snapshot of the front-end
+                    dug += len(digged)
+                    sender.send(
+                        ("frame", id, frame, delta_frame, keyframe, binary_frame, digged)
+                    )
+        finally:
+            # also when stopped, the front-end grades the game with this score
+            sender.send(("over", id, game.score, game.level, game.info()))
+            logger.info("Pacing: %s", game.pacing.summary())
+            del games[id], tasks[id]
+
+    loop.add_reader(conn.fileno(), receive)
+    await closed
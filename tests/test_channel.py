@@ -0,0 +1,96 @@
+import asyncio
+
+from channel import Channel
+
+
+class SlowClient:
+    def __init__(self, delay):
+        self.delay = delay
+        self.received = []
+        self.closed = False
+        self.closes = 0
+
+    async def send(self, message):
+        await asyncio.sleep(self.delay)
+        self.received.append(message)
+
+    async def close(self):
+        self.closed = True
+        self.closes += 1
+
+
+async def stream(channel, frames, period, keyframe=lambda i: True):
+    for i in range(frames):
+        channel.send_frame(f"frame {i}", keyframe(i))
+        await asyncio.sleep(period)
+    await asyncio.sleep(0.05)
+
+
+def test_latest_frame():
+    async def main():
+        client = SlowClient(delay=0.025)
+        channel = Channel(client)
+        channel.send("info")
+        await stream(channel, 20, period=0.005)
+        return client, channel
+
+    client, channel = asyncio.run(main())
+
+    assert client.received[0] == "info"
+    assert client.received[-1] == "frame 19"
+    assert channel.dropped > 0
+    assert channel.sent + channel.dropped == 21
+    assert not client.closed
+
+
+def test_delta_waits_for_keyframe():
+    async def main():
+        client = SlowClient(delay=0.025)
+        channel = Channel(client, delta=True)
+        await stream(channel, 20, period=0.005, keyframe=lambda i: i % 5 == 1)
+        return client
+
+    client = asyncio.run(main())
+
+    # every delta sent follows the keyframe or delta sent before it
+    numbers = [int(m.split()[1]) for m in client.received]
+    assert numbers[0] == 1
+    for before, after in zip(numbers, numbers[1:]):
+        assert after == before + 1 or after % 5 == 1
+
+
+def test_evict():
+    async def main():
+        client = SlowClient(delay=1)
+        channel = Channel(client, max_pending=4)
+        for i in range(5):
+            channel.send(f"info {i}")
+        channel.close()  # the client leaving after being evicted
+        await asyncio.sleep(0)
+        return client, channel
+
+    client, channel = asyncio.run(main())
+
+    assert client.closes == 1
+    assert channel.closed
+
+
+def test_window():
+    async def main():
+        client = SlowClient(delay=0)
+        channel = Channel(client, window=1, report=True)
+        channel.send_frame('{"step": 1}')
+        await asyncio.sleep(0.01)
+        for step in range(2, 6):  # no ack, the client is busy
+            channel.send_frame(f'{{"step": {step}}}')
+        await asyncio.sleep(0.01)
+        channel.ack()
+        await asyncio.sleep(0.01)
+        return client
+
+    client = asyncio.run(main())
+
+    assert client.received == [
+        '{"step": 1, "coalesced": 0, "queue": 0}',
+        '{"step": 5, "coalesced": 3, "queue": 0}',
+    ]
@@ -0,0 +1,40 @@
+import asyncio
+import json
+
+from highscores import Highscores
+
+
+def test_sorted_and_bounded(tmp_path):
+    path = tmp_path / "highscores.json"
+
+    async def main():
+        highscores = Highscores(path, 3)
+        for player, score in [("a", 10), ("b", 30), ("c", 20), ("d", 30), ("e", 5)]:
+            highscores.add(player, score)
+        await highscores.flush()
+        return highscores
+
+    highscores = asyncio.run(main())
+
+    assert highscores.tolist() == [("b", 30), ("d", 30), ("c", 20)]
+    assert json.loads(path.read_text()) == [["b", 30], ["d", 30], ["c", 20]]
+    assert not (tmp_path / "highscores.json.tmp").exists()
+    assert Highscores(path, 3).tolist() == highscores.tolist()
+
+
+def test_writes_coalesced(tmp_path, monkeypatch):
+    writes = []
+
+    async def main():
+        highscores = Highscores(tmp_path / "highscores.json", 10)
+        write = highscores._write
+        monkeypatch.setattr(highscores, "_write", lambda s: writes.append(s) or write(s))
+        for score in range(50):
+            highscores.add("p", score)
+        assert not highscores.add("p", 0)  # not good enough
+        await highscores.flush()
+
+    asyncio.run(main())
+
+    assert len(writes) <= 2
+    assert writes[-1] == [("p", score) for score in range(49, 39, -1)]
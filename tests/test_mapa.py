@@ -239,3 +239,77 @@ def test_map():
     # test blocked / diggable
     assert game.map.calc_pos((1, 1), Direction.SOUTH, traverse=False) == (1, 1)
     assert game.map.calc_pos((1, 1), Direction.SOUTH, traverse=True) == (1, 2)
+
+
+def test_generate_map():
+    mapa = Map(level=4, size=(48, 24))
+
+    for x in range(mapa.hor_tiles):
+        assert mapa.map[x][0] == Tiles.PASSAGE
+        assert mapa.map[x][1] == Tiles.PASSAGE
+
+    assert len(mapa.rocks_spawn) == 4
+    for x, y in mapa.rocks_spawn:
+        assert VITAL_SPACE < y < mapa.ver_tiles - VITAL_SPACE
+        assert mapa.map[x][y] == Tiles.STONE
+
+    for x, y in mapa.enemies_spawn:
+        assert not mapa.is_blocked((x, y), traverse=False)
+
+
+def test_distance():
+    mapa = Map(size=(13, 13), mapa=mapa13x13)
+
+    assert mapa.distance((1, 1), (1, 1)) == 0
+    assert mapa.distance((1, 1), (1, 3)) == 4  # around the stone at (1, 2)
+    assert mapa.distance((1, 1), (0, 0)) is None  # stone
+
+    mapa.dig((1, 2))
+    assert mapa.distance((1, 1), (1, 3)) == 2
+    assert mapa.distance((1, 1), (2, 3)) == 3
+
+    assert mapa.distance((4, 4), (1, 1)) == 6
+
+
+def test_occupancy():
+    rocks = Occupancy([Rock((2, 3)), Rock((5, 5))])
+    assert (2, 3) in rocks.positions
+
+    rock = next(iter(rocks))
+    rock.pos = (2, 4)
+    assert (2, 3) not in rocks.positions
+    assert rocks.at((2, 4)) == [rock]
+    assert not rocks.taken((2, 4), exclude=rock)
+
+    rocks.remove(rock)
+    assert len(rocks) == 1
+    assert (2, 4) not in rocks.positions
+
+
+def test_step():
+    game = Game()
+    game.start("John Doe")
+
+    state = game.step("d")
+    assert state["step"] == 1
+    assert state["digdug"] == (2, 1)
+
+    state = game.step()
+    assert state["step"] == 2
+    assert state["digdug"] == (2, 1)
+
+
+def test_snapshot():
+    game = Game(level=5)
+    game.start("John Doe")
+    for key in "ddssAAdd":
+        game.step(key)
+
+    snapshot = game.snapshot()
+    keys = "ssssaaaAAAwwddddAA" * 5
+    states = [game.step(key) for key in keys]
+    map_tiles = game.map.tolist()
+
+    game.restore(snapshot)
+    assert [game.step(key) for key in keys] == states
+    assert game.map.tolist() == map_tiles
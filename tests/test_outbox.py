@@ -0,0 +1,104 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from outbox import Outbox
+
+
+class GradingServer(ThreadingHTTPServer):
+    """Stand-in grading server, failing the first `failures` posts."""
+
+    def __init__(self, failures=0):
+        super().__init__(("127.0.0.1", 0), GradingHandler)
+        self.failures = failures
+        self.records = []
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}/game"
+
+
+class GradingHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.server.failures > 0:
+            self.server.failures -= 1
+            self.send_response(503)
+        else:
+            self.server.records.append(json.loads(body))
+            self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def grading():
+    server = GradingServer()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+async def submit(outbox, records, wait=1):
+    task = asyncio.create_task(outbox.run())
+    for record in records:
+        outbox.put(record)
+    for _ in range(int(wait / 0.01)):
+        await asyncio.sleep(0.01)
+        if not len(outbox):
+            break
+    task.cancel()
+
+
+def test_submit(grading, tmp_path):
+    records = [{"player": f"p{i}", "score": i, "level": 1} for i in range(5)]
+
+    async def main():
+        outbox = Outbox(grading.url, spool=tmp_path / "spool", batch=2)
+        await submit(outbox, records)
+        return outbox
+
+    outbox = asyncio.run(main())
+
+    assert grading.records == records
+    assert len(outbox) == 0
+    assert (tmp_path / "spool").read_text() == ""
+
+
+def test_retry(grading, tmp_path):
+    grading.failures = 2
+    records = [{"player": "p", "score": 100, "level": 2}]
+
+    async def main():
+        outbox = Outbox(grading.url, spool=tmp_path / "spool", backoff=0.01)
+        await submit(outbox, records)
+
+    asyncio.run(main())
+
+    assert grading.records == records
+
+
+def test_replay(grading, tmp_path):
+    records = [{"player": f"p{i}", "score": i, "level": 1} for i in range(3)]
+
+    async def down():
+        # nobody listening on the url, nothing gets sent
+        outbox = Outbox("http://127.0.0.1:1/game", spool=tmp_path / "spool")
+        await submit(outbox, records, wait=0.1)
+
+    async def restart():
+        outbox = Outbox(grading.url, spool=tmp_path / "spool")
+        assert len(outbox) == 3
+        await submit(outbox, [])
+
+    asyncio.run(down())
+    asyncio.run(restart())
+
+    assert grading.records == records
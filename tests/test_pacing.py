@@ -0,0 +1,53 @@
+import asyncio
+import time
+
+from pacing import LockstepScheduler, TickScheduler
+
+
+async def tick(scheduler, n, work):
+    start = time.perf_counter()
+    for _ in range(n):
+        await scheduler.wait()
+        time.sleep(work)  # frame compute and sends, blocking the loop
+    return time.perf_counter() - start
+
+
+def test_no_drift():
+    scheduler = TickScheduler(fps=100)
+    elapsed = asyncio.run(tick(scheduler, 20, work=0.005))
+
+    # work is absorbed by the period instead of adding to it
+    assert elapsed < 20 * 0.010 + 0.005 + 0.030
+    assert scheduler.ticks == 20
+    assert scheduler.skipped == 0
+    assert len(scheduler.compute) == 19
+    assert min(scheduler.compute) >= 0.005
+
+
+def test_skip_when_too_late():
+    scheduler = TickScheduler(fps=100, max_lag=2)
+    asyncio.run(tick(scheduler, 3, work=0.055))
+
+    assert scheduler.skipped > 0
+    assert scheduler.summary()["ticks"] == 3
+
+
+def test_lockstep():
+    async def main():
+        scheduler = LockstepScheduler(max_wait=0.05)
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        for _ in range(10):
+            loop.call_later(0.001, scheduler.answered)  # a fast player
+            await scheduler.wait()
+        fast = time.perf_counter() - start
+
+        await scheduler.wait()  # nobody answers
+        return scheduler, fast
+
+    scheduler, fast = asyncio.run(main())
+
+    assert fast < 10 * 0.05 / 2
+    assert scheduler.ticks == 11
+    assert scheduler.timeouts == 1
+    assert scheduler.summary()["answer_max"] >= 0.05
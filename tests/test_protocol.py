@@ -0,0 +1,115 @@
+import json
+
+from game import Game
+from protocol import (
+    BinaryEncoder,
+    DeltaDecoder,
+    DeltaEncoder,
+    LevelSnapshot,
+    decode,
+    encode_info,
+    report,
+)
+
+
+def frames(level=5, keys="ssssddddAAAAwwaaAAssdd" * 10):
+    game = Game(level=level)
+    game.start("John Doe")
+    for key in keys:
+        if state := game.step(key):
+            yield state, game.map.digged
+
+
+def test_delta():
+    encoder = DeltaEncoder(keyframe_interval=10)
+    decoder = DeltaDecoder()
+
+    digged = []
+    for i, (state, level_digged) in enumerate(frames()):
+        frame = json.loads(json.dumps(encoder.encode(state, level_digged)))
+        assert ("keyframe" in frame) == (i % 10 == 0)
+        assert ("delta" in frame) != (i % 10 == 0)
+
+        if "keyframe" in frame:
+            digged = []  # keyframes carry every tile dug so far
+        decoded = decoder.decode(frame)
+        digged.extend(tuple(pos) for pos in decoded.pop("digged"))
+        assert decoded == json.loads(json.dumps(state))
+    assert digged == level_digged
+
+
+def test_delta_late_join():
+    encoder = DeltaEncoder(keyframe_interval=10)
+    decoder = DeltaDecoder()
+
+    for i, (state, digged) in enumerate(frames()):
+        frame = json.loads(json.dumps(encoder.encode(state, digged)))
+        if i < 5:
+            continue  # not connected yet
+        decoded = decoder.decode(frame)
+        if i < 10:
+            assert decoded is None
+        else:
+            decoded.pop("digged")
+            assert decoded == json.loads(json.dumps(state))
+
+
+def test_binary():
+    encoder = BinaryEncoder()
+    ids = {}
+
+    for state, _ in frames():
+        state["ts"] = 1234.5
+        decoded = decode(encoder.encode(state))
+
+        expected = json.loads(json.dumps(state))
+        for key in ("enemies", "rocks"):
+            for entity, decoded_entity in zip(expected[key], decoded[key]):
+                # uuids are replaced by small ids, the same for the whole game
+                small = decoded_entity.pop("id")
+                assert ids.setdefault(entity.pop("id"), small) == small
+        assert decoded == expected
+    assert len(set(ids.values())) == len(ids)
+
+
+def test_binary_info():
+    game = Game(level=3)
+    game.start("John Doe")
+    info = game.info()
+
+    record = encode_info(info)
+    assert decode(record) == json.loads(json.dumps(info))
+    assert len(record) < len(json.dumps(info)) / 2
+
+    info["highscores"] = []
+    assert encode_info(info) is None
+
+
+def test_binary_report():
+    state = next(frames())[0]
+    frame = report(BinaryEncoder().encode(state), coalesced=3, queue=1)
+
+    decoded = decode(frame)
+    assert (decoded["coalesced"], decoded["queue"]) == (3, 1)
+    assert decode(report(json.dumps(state), 3, 1))["coalesced"] == 3
+
+
+def test_level_snapshot():
+    game = Game(level=2)
+    game.start("John Doe")
+    snapshot = LevelSnapshot(game.info())
+    encoder = BinaryEncoder()
+
+    dug = 0
+    for key in "ssssddddsssaaaa":
+        if state := game.step(key):
+            frame, binary_frame = json.dumps(state), encoder.encode(state)
+            snapshot.update(frame, binary_frame, game.map.digged[dug:])
+            dug = len(game.map.digged)
+
+    message, binary_message = snapshot.messages()
+    for joined in (json.loads(message), decode(binary_message)):
+        assert joined["map"] == game.map.tolist()
+        assert joined["state"]["step"] == state["step"]
+        assert joined["state"]["digdug"] == list(state["digdug"])
+    assert snapshot.messages()[0] == message
@@ -0,0 +1,31 @@
+from server import GameServer, Player, Session
+
+
+def start(server, name):
+    session = Session(Player(name, object()))
+    server.attach(session)
+    return session
+
+
+def test_viewer_of_a_player():
+    server = GameServer(level=1, timeout=100, sessions=2)
+    anyone, fan = object(), object()
+    server.watch(anyone)
+    server.watch(fan, "b")
+
+    a = start(server, "a")
+    assert a.viewers == {anyone}
+
+    b = start(server, "b")
+    assert b.viewers == {fan}
+
+    # the game of b is over, its viewer waits for the next game of b
+    server.detach(b)
+    c = start(server, "c")
+    assert fan not in c.viewers
+    b = start(server, "b")
+    assert b.viewers == {fan}
+
+    late = object()
+    assert server.watch(late, "c") is c
+    assert c.viewers == {late}
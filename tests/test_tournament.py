@@ -0,0 +1,69 @@
+import random
+
+from game import Game
+from tournament import parse_seeds, play, report, tournament
+
+
+def digger():
+    keys = iter("ssssddddAAAA" * 1000)
+
+    def agent(message):
+        if "map" in message:
+            return None
+        return next(keys)
+
+    return agent
+
+
+def test_play():
+    result = play(digger, seed=1, timeout=100)
+    assert result["seed"] == 1
+    assert result["total_steps"] == 100
+    assert play(digger, seed=1, timeout=100) == result
+
+
+def recorder():
+    messages = []
+
+    def agent(message):
+        messages.append(message)
+
+    agent.messages = messages
+    recorder.agent = agent
+    return agent
+
+
+def positions(state):
+    """Characters of a frame by position, ids are random for every game."""
+    return {
+        key: [{k: v for k, v in e.items() if k != "id"} for e in state[key]]
+        for key in ("enemies", "rocks")
+    } | {"digdug": state["digdug"]}
+
+
+def test_seed_reproduces_server_games():
+    play(recorder, seed=5, timeout=10)
+    messages = recorder.agent.messages
+
+    # as GameServer.play does it
+    game = Game(timeout=10)
+    random.seed(5)
+    game.start("recorder")
+
+    assert messages[0] == game.info()
+    assert positions(messages[1]) == positions(game.step(""))
+
+
+def test_tournament():
+    results = list(
+        tournament(["test_tournament:digger"], parse_seeds("1-3"), 2, timeout=50)
+    )
+    assert sorted(r["seed"] for r in results) == [1, 2, 3]
+
+    (ranking,) = report(results)
+    assert ranking["agent"] == "test_tournament:digger"
+    assert ranking["games"] == 3
+
+
+def test_parse_seeds():
+    assert parse_seeds("1-3,7") == [1, 2, 3, 7]
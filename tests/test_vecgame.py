@@ -0,0 +1,23 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from consts import Tiles
+from vecgame import VecGame
+
+
+def test_vecgame():
+    games = VecGame(3)
+    obs = games.reset(seed=1)
+    assert obs["tiles"].shape == (3, 48, 24)
+    assert (obs["digdug"] == (1, 1)).all()
+    assert (obs["tiles"][:, :, :2] == Tiles.PASSAGE).all()
+
+    obs, rewards, dones = games.step(["s", "d", None])
+    assert obs["digdug"].tolist() == [[1, 2], [2, 1], [1, 1]]
+    assert obs["tiles"][0, 1, 2] == Tiles.PASSAGE
+    assert rewards.shape == dones.shape == (3,)
+    assert not dones.any()
+
+    for game, tiles in zip(games.games, obs["tiles"]):
+        assert tiles.tolist() == game.map.tolist()
@@ -0,0 +1,42 @@
+import random
+
+import pytest
+
+pygame = pytest.importorskip("pygame")
+np = pytest.importorskip("numpy")
+
+import viewer  # noqa: E402
+from consts import Tiles  # noqa: E402
+from mapa import Map  # noqa: E402
+
+
+def draw_tiles(mapa):
+    """The background drawn a rectangle per tile."""
+    background = pygame.Surface(viewer.scale(mapa.size))
+    for x in range(mapa.hor_tiles):
+        for y in range(mapa.ver_tiles):
+            if mapa.map[x][y] != Tiles.STONE:
+                color = viewer.BACKGROUND_COLOR
+            elif y < mapa.ver_tiles / 4:
+                color = viewer.BACKGROUND_GROUND_LAYER
+            elif y < mapa.ver_tiles / 2:
+                color = viewer.BACKGROUND_MIDDLE_LAYER
+            elif y < mapa.ver_tiles * 3 / 4:
+                color = viewer.BACKGROUND_BOTTOM_LAYER
+            else:
+                color = viewer.BACKGROUND_BED_LAYER
+            rect = (*viewer.scale((x, y)), *viewer.scale((1, 1)))
+            pygame.draw.rect(background, color, rect)
+    return background
+
+
+@pytest.mark.parametrize("scale", [1, 2, 3, 5])
+def test_draw_background(monkeypatch, scale):
+    monkeypatch.setattr(viewer, "SCALE", scale)
+    random.seed(3)
+    mapa = Map(size=(48, 24))
+    for x in range(5, 20):
+        mapa.dig((x, 12))
+
+    background = pygame.surfarray.array3d(viewer.draw_background(mapa))
+    assert np.array_equal(background, pygame.surfarray.array3d(draw_tiles(mapa)))
@@ -0,0 +1,119 @@
+"""Play agents over many seeds in parallel, without a server."""
+import argparse
+import importlib
+import json
+import random
+import statistics
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from consts import LIVES, TIMEOUT
+from game import Game
+
+
+def load_agent(agent):
+    """Agent factory from a "module:name" string, or the factory itself.
+
+    The factory is called once per game and returns a callable that gets the
+    same messages a client gets from the server, the level info and then
+    every frame, and returns the key to press ("" or None for no key).
+    """
+    if callable(agent):
+        return agent
+    module, _, name = agent.partition(":")
+    return getattr(importlib.import_module(module), name)
+
+
+def play(agent, seed, level=1, lives=LIVES, timeout=TIMEOUT):
+    """Play a whole game, the same way GameServer.mainloop does."""
+    name = agent if isinstance(agent, str) else agent.__name__
+    player = load_agent(agent)()
+
+    game = Game(level=level, lives=lives, timeout=timeout)
+    random.seed(seed)  # after building the game, like the server does
+    game.start(name)
+
+    key = ""
+    while game.running:
+        if game._step == 0:  # starting a level, send the info
+            player(game.info())
+        state = game.step(key)
+        key = (player(state) or "") if state else ""  # a key is pressed once
+
+    return {
+        "agent": name,
+        "seed": seed,
+        "score": game.score,
+        "level": game.level,
+        "total_steps": game.total_steps,
+        "lives": game._digdug.lives,
+    }
+
+
+def tournament(agents, seeds, workers=None, **kwargs):
+    """Play every agent on every seed, yielding results as games finish."""
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        games = [
+            executor.submit(play, agent, seed, **kwargs)
+            for agent in agents
+            for seed in seeds
+        ]
+        for game in as_completed(games):
+            yield game.result()
+
+
+def report(results):
+    """Aggregate results per agent, best average score first."""
+    agents = {}
+    for result in results:
+        agents.setdefault(result["agent"], []).append(result)
+
+    ranking = []
+    for agent, games in agents.items():
+        scores = [g["score"] for g in games]
+        ranking.append(
+            {
+                "agent": agent,
+                "games": len(games),
+                "mean_score": statistics.mean(scores),
+                "median_score": statistics.median(scores),
+                "min_score": min(scores),
+                "max_score": max(scores),
+                "mean_level": statistics.mean(g["level"] for g in games),
+                "mean_total_steps": statistics.mean(g["total_steps"] for g in games),
+                "mean_lives": statistics.mean(g["lives"] for g in games),
+            }
+        )
+    return sorted(ranking, key=lambda r: r["mean_score"], reverse=True)
+
+
+def parse_seeds(text):
+    """Seeds from a list of numbers and ranges, like "1-100,200"."""
+    seeds = []
+    for part in text.split(","):
+        first, _, last = part.partition("-")
+        seeds.extend(range(int(first), int(last or first) + 1))
+    return seeds
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("agents", nargs="+", help="Agent factories, as module:name")
+    parser.add_argument("--seeds", help="Seeds, like 1-100,200", default="1-10")
+    parser.add_argument("--workers", help="Worker processes", type=int, default=None)
+    parser.add_argument("--level", help="Starting level", type=int, default=1)
+    parser.add_argument("--timeout", help="Steps per level", type=int, default=TIMEOUT)
+    args = parser.parse_args()
+
+    results = []
+    for result in tournament(
+        args.agents,
+        parse_seeds(args.seeds),
+        args.workers,
+        level=args.level,
+        timeout=args.timeout,
+    ):
+        print(json.dumps(result), flush=True)
+        results.append(result)
+
+    for rank, agent in enumerate(report(results), 1):
+        print(json.dumps({"rank": rank, **agent}))
@@ -0,0 +1,119 @@
+"""Batch of independent games stepped in lockstep, for training agents."""
+import random
+
+import numpy as np
+
+from consts import LIVES, TIMEOUT, Tiles
+from game import MAP_SIZE, Game
+
+MAX_ENEMIES = 16
+MAX_ROCKS = 16
+
+
+class VecGame:
+    """N games advanced together, with their state stacked in NumPy arrays.
+
+    Observations are a dict of arrays with one row per game: the map tiles,
+    the positions of Dig Dug, the enemies and the rocks (padded with -1)
+    and a few counters. The arrays are updated in place by every call to
+    step(), copy them if you need to keep them. Finished games are started
+    again right away, their final score is left in episode_scores.
+    """
+
+    def __init__(
+        self,
+        n,
+        level=1,
+        lives=LIVES,
+        timeout=TIMEOUT,
+        size=MAP_SIZE,
+        max_enemies=MAX_ENEMIES,
+        max_rocks=MAX_ROCKS,
+    ):
+        self.games = [Game(level, lives, timeout, size) for _ in range(n)]
+        self._maps = [None] * n  # map each row of tiles was copied from
+        self._digged = [0] * n  # digs of that map already applied
+
+        self.tiles = np.zeros((n, *size), dtype=np.uint8)
+        self.digdug = np.zeros((n, 2), dtype=np.int16)
+        self.enemies = np.full((n, max_enemies, 2), -1, dtype=np.int16)
+        self.rocks = np.full((n, max_rocks, 2), -1, dtype=np.int16)
+        self.lives = np.zeros(n, dtype=np.int8)
+        self.level = np.zeros(n, dtype=np.int16)
+        self.step_count = np.zeros(n, dtype=np.int16)
+        self.scores = np.zeros(n, dtype=np.int32)
+        self.episode_scores = np.zeros(n, dtype=np.int32)
+
+    def __len__(self):
+        return len(self.games)
+
+    @property
+    def observations(self):
+        return {
+            "tiles": self.tiles,
+            "digdug": self.digdug,
+            "enemies": self.enemies,
+            "rocks": self.rocks,
+            "lives": self.lives,
+            "level": self.level,
+            "step": self.step_count,
+        }
+
+    def reset(self, seed=None):
+        if seed is not None:
+            random.seed(seed)
+        for i, game in enumerate(self.games):
+            game.start(f"vecgame-{i}")
+            self._sync(i)
+        self.scores[:] = 0
+        return self.observations
+
+    def step(self, keys):
+        """Press one key in every game and advance them all one frame.
+
+        Returns the observations, the points scored in this frame and
+        whether each game finished in this frame.
+        """
+        rewards = np.zeros(len(self.games), dtype=np.int32)
+        dones = np.zeros(len(self.games), dtype=bool)
+        for i, (game, key) in enumerate(zip(self.games, keys)):
+            game.advance(key)
+            rewards[i] = game._score - self.scores[i]
+            if not game.running:
+                dones[i] = True
+                self.episode_scores[i] = game.score
+                game.start(f"vecgame-{i}")
+            self.scores[i] = game._score
+            self._sync(i)
+        return self.observations, rewards, dones
+
+    def _sync(self, i):
+        game = self.games[i]
+        mapa = game.map
+
+        digged = mapa.digged
+        if mapa is not self._maps[i] or len(digged) < self._digged[i]:
+            # new level (or a restored snapshot), copy the whole grid
+            grid, _ = mapa.snapshot()
+            self.tiles[i] = np.frombuffer(grid, dtype=np.uint8).reshape(
+                mapa.hor_tiles + 2, mapa.ver_tiles + 2
+            )[1:-1, 1:-1]
+            self._maps[i] = mapa
+        elif len(digged) > self._digged[i]:
+            xs, ys = zip(*digged[self._digged[i] :])
+            self.tiles[i, xs, ys] = Tiles.PASSAGE
+        self._digged[i] = len(digged)
+
+        self.digdug[i] = game._digdug.pos
+        self._fill(self.enemies[i], [e.pos for e in game._enemies])
+        self._fill(self.rocks[i], [r.pos for r in game._rocks])
+        self.lives[i] = game._digdug.lives
+        self.level[i] = mapa.level
+        self.step_count[i] = game._step
+
+    @staticmethod
+    def _fill(rows, positions):
+        positions = positions[: len(rows)]  # characters beyond max are left out
+        if positions:
+            rows[: len(positions)] = positions
+        rows[len(positions) :] = -1
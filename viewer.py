@@ -1,14 +1,18 @@
 import argparse
 import asyncio
+import functools
 import json
 import logging
 import os
 import sys
+import time
 
+import numpy as np
 import pygame
 import websockets
 
 from mapa import Map, Tiles
+from protocol import DeltaDecoder, decode
 
 logging.basicConfig(level=logging.DEBUG)
 logger_websockets = logging.getLogger("websockets")
@@ -87,8 +91,21 @@ BACKGROUND_GROUND_LAYER = (222, 204, 166)
 BACKGROUND_MIDDLE_LAYER = (148, 91, 20)
 BACKGROUND_BOTTOM_LAYER = (112, 100, 84)
 BACKGROUND_BED_LAYER = (56, 29, 10)
+BACKGROUND_PALETTE = np.array(
+    [
+        BACKGROUND_COLOR,
+        BACKGROUND_GROUND_LAYER,
+        BACKGROUND_MIDDLE_LAYER,
+        BACKGROUND_BOTTOM_LAYER,
+        BACKGROUND_BED_LAYER,
+    ],
+    dtype=np.uint8,
+)
 
 
+LAG_SHOWN = 1  # seconds the lag indicator stays after the viewer catches up
+TEXT_CACHE_SIZE = 256  # text surfaces kept, enough for the info bar and highscores
+
 RANKS = {
     1: "1ST",
     2: "2ND",
@@ -103,17 +120,52 @@ RANKS = {
 }
 
 SPRITES = None
+DECODER = DeltaDecoder()  # full states from delta frames, when the server sends them
 
 
 async def messages_handler(ws_path, queue):
     async with websockets.connect(ws_path) as websocket:
-        await websocket.send(json.dumps({"cmd": "join"}))
+        # delta frames if the server sends them, binary records otherwise
+        await websocket.send(json.dumps({"cmd": "join", "delta": True, "binary": True}))
 
         while True:
             r = await websocket.recv()
             queue.put_nowait(r)
 
 
+def latest_state(queue):
+    """Newest state waiting in queue, and how many states it skips.
+
+    A viewer that fell behind renders the newest state only, but what the
+    skipped states changed is kept: the tiles they dug, Dig Dug's trail
+    included, are added to its "digged", and a new level among them is
+    merged into it. The highscores end the game, the states after them are
+    left in the queue for the next one.
+    """
+    state, info, digged, skipped = None, None, [], 0
+    while not queue.empty():
+        message = DECODER.decode(decode(queue.get_nowait()))
+        if message is None:
+            continue
+        if state is not None:
+            skipped += 1
+            digged.extend(state.get("digged", []))
+            if "digdug" in state:
+                digged.append(state["digdug"])
+        if "map" in message:  # a new level, the tiles dug before are gone
+            info, digged = message, []
+        state = message
+        if "highscores" in state:
+            break
+
+    if state is None:
+        return None, 0
+    if info is not None and info is not state:
+        state = {**info, **state}
+    state["digged"] = digged + state.get("digged", [])
+    return state, skipped
+
+
 class Artifact(pygame.sprite.Sprite):
     def __init__(self, *args, **kw):
         self.x, self.y = None, None  # postpone to update_sprite()
@@ -151,17 +203,16 @@ class Rock(Artifact):
         self.name = "rock"
         super().__init__(*args, **kw)
 
+    def update(self, pos):
+        if scale(pos) != (self.x, self.y):
+            self.update_sprite(pos)
+
 
 class Rope(Artifact):
     def __init__(self, *args, **kw):
         super().__init__(*args, **kw)
 
-    def update(self, *args, **kw):
-        dir = kw.pop("dir")
-        pos = kw.pop("pos")
-        if kw.pop("sprite_id") != "rope":
-            return
-
+    def update(self, dir, pos):
         if dir in [1, 3]:  # East or West
             column = len(pos)
             line = 1
@@ -203,13 +254,7 @@ class Fire(Artifact):
     def __init__(self, *args, **kw):
         super().__init__(*args, **kw)
 
-    def update(self, *args, **kw):
-        dir = kw.pop("dir")
-        pos = kw.pop("pos")
-
-        if kw.pop("sprite_id") != self.sprite_id:
-            return
-
+    def update(self, dir, pos):
         column = len(pos)
         line = 1
 
@@ -261,9 +306,7 @@ class Enemy(Artifact):
         self.name = kw.pop("name")
         super().__init__(*args, **kw)
 
-    def update(self, pos, sprite_id, traverse=False):
-        if sprite_id != self.sprite_id:
-            return
+    def update(self, pos, traverse=False):
         x, y = scale(pos)
 
         if x > self.x:
@@ -288,46 +331,53 @@ class Enemy(Artifact):
         self.update_sprite(pos)
 
 
-def clear_callback(surf, rect):
-    """beneath everything there is a passage."""
-    pygame.draw.rect(surf, BACKGROUND_COLOR, rect)
-
-
 def scale(pos):
     x, y = pos
     return int(x * CHAR_LENGTH / SCALE), int(y * CHAR_LENGTH / SCALE)
 
 
 def draw_background(mapa):
-    background = pygame.Surface(scale((int(mapa.size[0]), int(mapa.size[1]))))
-    for x in range(int(mapa.size[0])):
-        for y in range(int(mapa.size[1])):
-            wx, wy = scale((x, y))
-            if mapa.map[x][y] == Tiles.STONE:
-                if y < mapa.ver_tiles / 4:
-                    pygame.draw.rect(
-                        background, BACKGROUND_GROUND_LAYER, (wx, wy, *scale((1, 1)))
-                    )
-                elif y < mapa.ver_tiles / 2:
-                    pygame.draw.rect(
-                        background, BACKGROUND_MIDDLE_LAYER, (wx, wy, *scale((1, 1)))
-                    )
-                elif y < mapa.ver_tiles * 3 / 4:
-                    pygame.draw.rect(
-                        background, BACKGROUND_BOTTOM_LAYER, (wx, wy, *scale((1, 1)))
-                    )
-                else:
-                    pygame.draw.rect(
-                        background, BACKGROUND_BED_LAYER, (wx, wy, *scale((1, 1)))
-                    )
-            else:
-                pygame.draw.rect(background, BACKGROUND_COLOR, (wx, wy, *scale((1, 1))))
+    """Tiles coloured by depth band, one pixel each, scaled up in one go."""
+    width, height = int(mapa.size[0]), int(mapa.size[1])
+
+    # stone is coloured by the band of its row, 1 to 4, passages by 0
+    depth = np.arange(height)
+    band = 1 + (depth >= height / 4) + (depth >= height / 2) + (depth >= height * 3 / 4)
+    stone = np.array(mapa.tolist()) == Tiles.STONE
+    pixels = BACKGROUND_PALETTE[stone * band]
+
+    side = scale((1, 1))[0]
+    tiles = pygame.surfarray.make_surface(pixels)
+    tiles = pygame.transform.scale(tiles, (width * side, height * side))
+    size = scale((width, height))
+    if tiles.get_size() == size:
+        return tiles
+
+    # CHAR_LENGTH / SCALE is rounded down, so some tiles are followed by a
+    # gap: the columns of tiles, then the rows, are moved where scale() puts
+    # them
+    columns = pygame.Surface((size[0], height * side))
+    for x in range(width):
+        columns.blit(tiles, (scale((x, 0))[0], 0), (x * side, 0, side, height * side))
+    background = pygame.Surface(size)
+    for y in range(height):
+        background.blit(columns, (0, scale((0, y))[1]), (0, y * side, size[0], side))
     return background
 
 
+@functools.lru_cache(maxsize=None)
+def get_font(size):
+    return pygame.font.Font(None, size)
+
+
+@functools.lru_cache(maxsize=TEXT_CACHE_SIZE)
+def render_text(text, color, size, background=None):
+    """Text rendered once, labels and unchanged values are reused every frame."""
+    return get_font(size).render(text, True, color, background)
+
+
 def draw_info(SCREEN, text, pos, color=(180, 0, 0), background=None):
-    myfont = pygame.font.Font(None, int(22 / SCALE))
-    textsurface = myfont.render(text, True, color, background)
+    textsurface = render_text(text, tuple(color), int(22 / SCALE), background)
 
     x, y = pos
     if x > SCREEN.get_width():
@@ -337,9 +387,6 @@ def draw_info(SCREEN, text, pos, color=(180, 0, 0), background=None):
 
     if background:
         SCREEN.blit(background, pos)
-    else:
-        erase = pygame.Surface(textsurface.get_size())
-        erase.fill(COLORS["grey"])
 
     SCREEN.blit(textsurface, pos)
     return textsurface.get_width(), textsurface.get_height()
@@ -356,11 +403,16 @@ async def main_game():
     main_group = pygame.sprite.LayeredUpdates()
     weapons_group = pygame.sprite.OrderedUpdates()
     enemies_group = pygame.sprite.OrderedUpdates()
+    rocks_group = pygame.sprite.OrderedUpdates()
+
+    # sprites by the id the server gives them, created once and moved after
+    enemies, fires, rocks = {}, {}, {}
+    rope = None
 
     logging.info("Waiting for map information from server")
     state = await q.get()  # first state message includes map information
     logging.debug("Initial game status: %s", state)
-    newgame_json = json.loads(state)
+    newgame_json = DECODER.decode(decode(state))
 
     GAME_SPEED = newgame_json["fps"]
     mapa = Map(size=newgame_json["size"], mapa=newgame_json["map"])
@@ -371,7 +423,20 @@ async def main_game():
     SCREEN.blit(BACKGROUND, (0, 0))
     main_group.add(DigDug(pos=mapa.digdug_spawn))
 
-    state = {"score": 0, "player": "player1", "digdug": (1, 1)}
+    # joining during a level, the info comes with the latest state
+    state = newgame_json.get("state") or {
+        "score": 0,
+        "player": "player1",
+        "digdug": (1, 1),
+    }
+
+    # only what changed is sent to the display: the tiles dug, the info bar
+    # and where sprites were and are now
+    info_bar = pygame.Rect((0, 0), (SCREEN.get_width(), scale((1, 1))[1]))
+    dirty = [SCREEN.get_rect()]
+
+    # states skipped the last time the viewer caught up with the server
+    lag, lagging_since = 0, None
 
     while True:
         if "size" in state and "map" in state:
@@ -381,21 +446,29 @@ async def main_game():
             BACKGROUND = draw_background(mapa)
 
             SCREEN.blit(BACKGROUND, (0, 0))
+            dirty.append(SCREEN.get_rect())
 
             main_group.empty()
             enemies_group.empty()
+            rocks_group.empty()
             weapons_group.empty()
+            enemies.clear(), fires.clear(), rocks.clear()
+            rope = None
             main_group.add(DigDug(pos=mapa.digdug_spawn))
             mapa.level = state["level"]
 
         if "digdug" in state:
-            # dig through removing the stone drawned in the background
+            # dig through removing the stone drawned in the background, the
+            # screen is restored from it once Dig Dug moves on
             pygame.draw.rect(
                 BACKGROUND, (0, 0, 0), scale(state["digdug"]) + scale((1, 1))
             )
 
-        if "highscores" not in state:
-            SCREEN.blit(BACKGROUND, (0, 0))
+        for digged in state.get("digged", []):
+            tile = pygame.Rect(scale(digged) + scale((1, 1)))
+            pygame.draw.rect(BACKGROUND, (0, 0, 0), tile)
+            SCREEN.blit(BACKGROUND, tile, tile)
+            dirty.append(tile)
 
         def quit():
             # clean up and exit
@@ -410,9 +483,14 @@ async def main_game():
         if pygame.key.get_pressed()[pygame.K_ESCAPE]:
             quit()
 
-        main_group.clear(SCREEN, clear_callback)
-        weapons_group.clear(SCREEN, clear_callback)
-        enemies_group.clear(SCREEN, clear_callback)
+        main_group.clear(SCREEN, BACKGROUND)
+        weapons_group.clear(SCREEN, BACKGROUND)
+        enemies_group.clear(SCREEN, BACKGROUND)
+        rocks_group.clear(SCREEN, BACKGROUND)
+
+        if "highscores" not in state:
+            SCREEN.blit(BACKGROUND, info_bar, info_bar)
+            dirty.append(info_bar)
 
         if "score" in state and "player" in state:
             text = str(state["score"])
@@ -445,58 +523,65 @@ async def main_game():
                 color=(255, 0, 0),
             )
 
+        if lag and time.monotonic() - lagging_since < LAG_SHOWN:
+            draw_info(
+                SCREEN, f"late: {lag}", (SCREEN.get_width() / 8, 1), COLORS["yellow"]
+            )
+
         if "digdug" in state:
             main_group.update(state["digdug"])
 
         if "rope" in state:
-            if len(weapons_group) == 0:
-                weapons_group.add(Rope())
-            weapons_group.update(
-                sprite_id="rope", dir=state["rope"]["dir"], pos=state["rope"]["pos"]
-            )
-        else:
-            weapons_group.empty()
+            if rope is None:
+                rope = Rope()
+                weapons_group.add(rope)
+            rope.update(dir=state["rope"]["dir"], pos=state["rope"]["pos"])
+        elif rope is not None:
+            weapons_group.remove(rope)
+            rope = None
 
         if "enemies" in state:
-            enemies_alive = []
+            alive = set()
             for enemy in state["enemies"]:
-                enemies_alive.append(enemy["id"])
+                id = enemy["id"]
+                alive.add(id)
 
-                if enemy["id"] not in [e.sprite_id for e in enemies_group]:
-                    enemies_group.add(
-                        Enemy(
-                            name=enemy["name"], pos=enemy["pos"], sprite_id=enemy["id"]
-                        )
+                if id not in enemies:
+                    enemies[id] = Enemy(
+                        name=enemy["name"], pos=enemy["pos"], sprite_id=id
                     )
+                    enemies_group.add(enemies[id])
                 else:
-                    enemies_group.update(
-                        sprite_id=enemy["id"],
-                        pos=enemy["pos"],
-                        traverse="traverse" in enemy,
-                    )
+                    enemies[id].update(enemy["pos"], traverse="traverse" in enemy)
 
                 if "fire" in enemy:
-                    if enemy["id"] not in [w.sprite_id for w in weapons_group]:
-                        weapons_group.add(Fire(sprite_id=enemy["id"]))
-                    weapons_group.update(
-                        sprite_id=enemy["id"], dir=enemy["dir"], pos=enemy["fire"]
-                    )
-                elif enemy["id"] in [w.sprite_id for w in weapons_group]:
-                    weapons_group.remove(
-                        [w for w in weapons_group if w.sprite_id == enemy["id"]][0]
-                    )
-
-            for e in enemies_group:  # remove dead enemies
-                if e.sprite_id not in enemies_alive:
-                    enemies_group.remove(e)
+                    if id not in fires:
+                        fires[id] = Fire(sprite_id=id)
+                        weapons_group.add(fires[id])
+                    fires[id].update(dir=enemy["dir"], pos=enemy["fire"])
+                elif id in fires:
+                    weapons_group.remove(fires.pop(id))
+
+            for id in enemies.keys() - alive:  # remove dead enemies
+                enemies_group.remove(enemies.pop(id))
+                if id in fires:
+                    weapons_group.remove(fires.pop(id))
 
         if "rocks" in state:
+            fallen = rocks.keys() - {rock["id"] for rock in state["rocks"]}
+            for id in fallen:
+                rocks_group.remove(rocks.pop(id))
             for rock in state["rocks"]:
-                enemies_group.add(Rock(pos=rock["pos"], sprite_id=rock["id"]))
+                if rock["id"] not in rocks:
+                    rocks[rock["id"]] = Rock(pos=rock["pos"], sprite_id=rock["id"])
+                    rocks_group.add(rocks[rock["id"]])
+                else:
+                    rocks[rock["id"]].update(rock["pos"])
 
-        main_group.draw(SCREEN)
-        enemies_group.draw(SCREEN)
-        weapons_group.draw(SCREEN)
+        dirty.extend(main_group.draw(SCREEN))
+        dirty.extend(enemies_group.draw(SCREEN))
+        dirty.extend(rocks_group.draw(SCREEN))
+        dirty.extend(weapons_group.draw(SCREEN))
 
         if "highscores" in state:
             highscores = state["highscores"]
@@ -544,13 +629,16 @@ async def main_game():
             pygame.display.flip()  # Show highscores and wait for a new game
             break
 
-        pygame.display.flip()
+        pygame.display.update(dirty)
+        dirty = []
 
-        try:
-            state = json.loads(q.get_nowait())
-        except asyncio.queues.QueueEmpty:
+        latest, skipped = latest_state(q)
+        if skipped:
+            lag, lagging_since = skipped, time.monotonic()
+        if latest is None:
             await asyncio.sleep(1.0 / GAME_SPEED)
             continue
+        state = latest
 
 
 if __name__ == "__main__":